@@ -0,0 +1,278 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import fnmatch
+import shutil
+import tempfile
+import time
+import os
+
+from civ5_wallpapers import fpk
+from civ5_wallpapers import manifest
+from civ5_wallpapers import packset
+from civ5_wallpapers import extractor
+
+from . import synthetic
+
+
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """Register a benchmark
+
+    The decorated function receives the benchmark environment and returns
+    a (run, items, bytes) tuple: ``run`` is the callable being timed, while
+    ``items`` and ``bytes`` are how much work each call of it does."""
+    def decorator(func):
+        BENCHMARKS.append((name, func))
+        return func
+    return decorator
+
+
+class Environment:
+    """Synthetic files shared by all the benchmarks"""
+
+    def __init__(self, directory, args):
+        self.directory = directory
+        self.args = args
+
+        self.pack = os.path.join(directory, "uitextures.fpk")
+        synthetic.write_pack(self.pack, synthetic.filler_items(
+            args.items, args.item_size
+        ))
+
+        self.game_dir = synthetic.make_game_dir(
+            os.path.join(directory, "game"), {
+                "uitextures.fpk": synthetic.wallpaper_items(
+                    args.wallpapers, args.width, args.height
+                ),
+            },
+        )
+
+        self._large_packs = None
+
+    def large_packs(self):
+        """Get the paths of two large packs, created the first time
+
+        They're big enough for reading them to take a while even from the
+        disk cache, and their members are named so that the sorted names
+        alternate between the packs and don't follow the offsets."""
+        if self._large_packs is None:
+            count = self.args.large_size * 1024 // self.args.large_item_size
+            items = list(synthetic.filler_items(
+                count, self.args.large_item_size * 1024
+            ))
+
+            self._large_packs = []
+            for i, name in enumerate(["uitextures.fpk", "dlc1uitextures.fpk"]):
+                path = self.path("large", name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                synthetic.write_pack(path, items[i::2])
+                self._large_packs.append(path)
+        return self._large_packs
+
+    def path(self, *parts):
+        """Get a path inside the benchmark directory"""
+        return os.path.join(self.directory, *parts)
+
+    def clean(self, *parts):
+        """Remove a path inside the benchmark directory"""
+        shutil.rmtree(self.path(*parts), ignore_errors=True)
+
+
+@benchmark("fpk.header-parse")
+def bench_header_parse(env):
+    size = fpk.open(env.pack).offsets[0]
+
+    def run():
+        fpk.open(env.pack).close()
+    return run, env.args.items, size
+
+
+@benchmark("fpk.extract-single")
+def bench_extract_single(env):
+    pack = fpk.open(env.pack)
+    name = pack.files()[len(pack.files()) // 2]
+    _, size = pack.entry(name)
+    pack.close()
+
+    def run():
+        pack = fpk.open(env.pack)
+        pack.extract(name, env.path("single"))
+        pack.close()
+    return run, 1, size
+
+
+@benchmark("fpk.extract-all")
+def bench_extract_all(env):
+    pack = fpk.open(env.pack)
+    size = sum(pack.sizes)
+    pack.close()
+
+    def run():
+        env.clean("all")
+        pack = fpk.open(env.pack)
+        for name in pack.files():
+            pack.extract(name, env.path("all"))
+        pack.close()
+    return run, env.args.items, size
+
+
+@benchmark("extractor.extract-wallpapers")
+def bench_extract_wallpapers(env):
+    size = os.path.getsize(
+        os.path.join(env.game_dir, extractor.PACKS_DIR, "uitextures.fpk")
+    )
+
+    def run():
+        env.clean("wallpapers")
+        extractor.extract_wallpapers(
+            env.game_dir, env.path("wallpapers"), env.args.jobs
+        )
+    return run, env.args.wallpapers, size
+
+
+def drop_caches(paths):
+    """Evict some files from the page cache, as far as the kernel allows
+
+    Clean pages can be dropped without any privilege, but this has no
+    effect on filesystems without a backing store, like tmpfs."""
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def open_large_packs(env):
+    """Open the large packs as the extractor does"""
+    return packset.open(env.large_packs(), use_mmap=True)
+
+
+@benchmark("extractor.plan-cold-name-order")
+def bench_plan_cold_name_order(env):
+    packs = open_large_packs(env)
+    size = sum(sum(pack.sizes) for pack in packs.packs)
+    count = len(packs)
+    packs.close()
+
+    # The members are hashed one by one in name order, as the planner did
+    # before reading them in archive order
+    def run():
+        drop_caches(env.large_packs())
+        packs = open_large_packs(env)
+        sources = manifest.Sources({})
+        for file in packs.files():
+            for pack in packs.lookup_all(file):
+                sources.hash(pack, file)
+        packs.close()
+    return run, count, size
+
+
+@benchmark("extractor.plan-cold")
+def bench_plan_cold(env):
+    packs = open_large_packs(env)
+    size = sum(sum(pack.sizes) for pack in packs.packs)
+    count = len(packs)
+    packs.close()
+
+    def run():
+        drop_caches(env.large_packs())
+        packs = open_large_packs(env)
+        for pack in packs.packs:
+            pack.advise_sequential()
+        extractor.plan_wallpapers(
+            packs, manifest.Sources({}), ["*"],
+            env.args.read_ahead * 1024 * 1024,
+        )
+        packs.close()
+    return run, count, size
+
+
+def measure(run, repeat):
+    """Get the best wall time out of some runs of a callable"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def build_argparse():
+    """Build the argparse instance"""
+    parser = argparse.ArgumentParser(prog="benchmarks")
+    parser.add_argument("filter", nargs="?", default="*",
+                        help="Only run the benchmarks matching this glob")
+    parser.add_argument("-r", "--repeat", type=int, default=5,
+                        help="Number of runs of every benchmark")
+    parser.add_argument("--items", type=int, default=20000,
+                        help="Number of items in the synthetic pack")
+    parser.add_argument("--item-size", type=int, default=4096,
+                        help="Size of the items in the synthetic pack")
+    parser.add_argument("--wallpapers", type=int, default=16,
+                        help="Number of synthetic wallpapers")
+    parser.add_argument("--width", type=int, default=1024,
+                        help="Width of the synthetic wallpapers")
+    parser.add_argument("--height", type=int, default=768,
+                        help="Height of the synthetic wallpapers")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="Number of parallel extraction jobs")
+    parser.add_argument("--large-size", type=int, default=256,
+                        help="Total size (in MB) of the large packs")
+    parser.add_argument("--large-item-size", type=int, default=256,
+                        help="Size (in KB) of the items in the large packs")
+    parser.add_argument("--read-ahead", type=int, default=64,
+                        help="Read-ahead window (in MB) of the I/O planner")
+    parser.add_argument("--dir", default=None,
+                        help="Create the synthetic files here instead of "
+                             "in the temporary directory (which might be "
+                             "on tmpfs, where caches can't be dropped)")
+    return parser
+
+
+def main():
+    """Run the benchmarks"""
+    args = build_argparse().parse_args()
+
+    with tempfile.TemporaryDirectory(
+        prefix="civ5-wallpapers-bench-", dir=args.dir
+    ) as tmp:
+        env = Environment(tmp, args)
+
+        print("%-32s %10s %12s %10s" % (
+            "benchmark", "time", "items/s", "MB/s",
+        ))
+        for name, func in BENCHMARKS:
+            if not fnmatch.fnmatch(name, args.filter):
+                continue
+
+            run, items, size = func(env)
+            elapsed = measure(run, args.repeat)
+            print("%-32s %9.2fms %12.0f %10.1f" % (
+                name, elapsed * 1000, items / elapsed,
+                size / elapsed / 1024 / 1024,
+            ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import tracemalloc
+import argparse
+import tempfile
+import time
+import io
+import os
+
+from civ5_wallpapers import extractor
+from civ5_wallpapers.stats import Stats, MB
+
+from . import synthetic
+
+if extractor.dds is None:
+    raise SystemExit("Error: the memory benchmarks need numpy and Pillow")
+
+import PIL.Image
+from civ5_wallpapers import dds
+
+
+# Only numpy and Python allocations are traced: the memory used by Pillow's
+# encoder and by external processes isn't included in the peaks
+
+def convert_full(data, dest_file, settings):
+    """Decode the whole texture, then encode it with Pillow"""
+    image = PIL.Image.fromarray(dds.decode(data)[..., :3])
+    encoded = io.BytesIO()
+    image.save(encoded, "JPEG", quality=settings.quality)
+    with open(dest_file, "wb") as f:
+        f.write(encoded.getbuffer())
+
+
+def convert_bands(data, dest_file, settings):
+    """Decode the texture one band at a time, discarding the bands"""
+    with open(os.devnull, "wb") as f:
+        for band in dds.decode_bands(data):
+            f.write(band[..., :3].tobytes())
+
+
+def convert_stream(data, dest_file, settings):
+    """Decode the texture one band at a time, streaming it to cjpeg"""
+    if not extractor.stream_texture(data, dest_file, settings, Stats()):
+        raise RuntimeError("cjpeg failed")
+
+
+# The ways textures can be converted, the last one only if cjpeg is available
+STRATEGIES = [
+    ("full", convert_full),
+    ("bands", convert_bands),
+    ("stream", convert_stream),
+]
+
+
+def measure(function, data, dest_file, settings):
+    """Run a conversion, returning its peak traced memory and its time"""
+    tracemalloc.start()
+    try:
+        start = time.perf_counter()
+        function(data, dest_file, settings)
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak, elapsed
+
+
+def parse_size(value):
+    """Parse a WIDTHxHEIGHT texture size"""
+    try:
+        width, height = value.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid size: %s" % value)
+
+
+def build_argparse():
+    """Build the argparse instance"""
+    parser = argparse.ArgumentParser(prog="benchmarks.memory")
+    parser.add_argument("-s", "--size", type=parse_size, action="append",
+                        dest="sizes", metavar="WIDTHxHEIGHT",
+                        help="Size of the synthetic textures (can be "
+                             "repeated, default 2048x2048 to 8192x8192)")
+    parser.add_argument("-f", "--fourcc", choices=["DXT1", "DXT3", "DXT5"],
+                        default="DXT5", help="Format of the textures")
+    return parser
+
+
+def main():
+    """Run the memory benchmarks"""
+    args = build_argparse().parse_args()
+    sizes = args.sizes or [(2048, 2048), (4096, 4096), (8192, 8192)]
+    settings = extractor.ConversionSettings()
+
+    strategies = STRATEGIES
+    if extractor.stream_command("", settings) is None:
+        print("cjpeg not found, skipping the stream benchmark")
+        strategies = strategies[:-1]
+
+    print("%-12s %-8s %12s %12s %10s" % (
+        "texture", "strategy", "decoded", "peak", "time",
+    ))
+    with tempfile.TemporaryDirectory(prefix="civ5-wallpapers-bench-") as tmp:
+        dest_file = os.path.join(tmp, "wallpaper.jpg")
+        for width, height in sizes:
+            data = synthetic.make_dds(width, height, args.fourcc.encode())
+            decoded = width * height * 4
+
+            for name, function in strategies:
+                peak, elapsed = measure(function, data, dest_file, settings)
+                print("%-12s %-8s %10.1fMB %10.1fMB %9.2fs" % (
+                    "%sx%s" % (width, height), name, decoded / MB,
+                    peak / MB, elapsed,
+                ))
+
+
+if __name__ == "__main__":
+    main()
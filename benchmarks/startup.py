@@ -0,0 +1,182 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import argparse
+import subprocess
+import tempfile
+import time
+import sys
+import os
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The commands changing the wallpaper, as run by cron and timers
+COMMANDS = [
+    ("rotate", ["-m", "civ5_wallpapers.rotate"]),
+    ("cli.set-random", ["-m", "civ5_wallpapers", "set-random"]),
+]
+
+# Modules the rotation entry point must never import
+FORBIDDEN_MODULES = [
+    "argparse",
+    "asyncio",
+    "concurrent.futures",
+    "numpy",
+    "civ5_wallpapers.extractor",
+    "civ5_wallpapers.fpk",
+    "civ5_wallpapers.steam",
+]
+
+# A desktop backend accepting everything without doing anything
+STUB_GSETTINGS = "#!/bin/sh\nexit 0\n"
+
+
+class Environment:
+    """Wallpapers directory and stub desktop backend used by the commands"""
+
+    def __init__(self, directory):
+        self.wallpapers = os.path.join(directory, "wallpapers")
+        os.makedirs(self.wallpapers)
+        for i in range(16):
+            with open(os.path.join(self.wallpapers, "loading_%s.jpg" % i),
+                      "wb"):
+                pass
+
+        bin_dir = os.path.join(directory, "bin")
+        os.makedirs(bin_dir)
+        gsettings = os.path.join(bin_dir, "gsettings")
+        with open(gsettings, "w") as f:
+            f.write(STUB_GSETTINGS)
+        os.chmod(gsettings, 0o755)
+
+        self.env = dict(os.environ)
+        self.env["PATH"] = bin_dir + os.pathsep + self.env.get("PATH", "")
+        if self.env.get("PYTHONPATH"):
+            self.env["PYTHONPATH"] = ROOT + os.pathsep + self.env["PYTHONPATH"]
+        else:
+            self.env["PYTHONPATH"] = ROOT
+        self.env["DBUS_SESSION_BUS_ADDRESS"] = "unix:path=/dev/null"
+
+    def command(self, args, *options):
+        """Get the full command line changing the wallpaper"""
+        return [sys.executable] + list(options) + args + [
+            "-d", self.wallpapers, "gnome",
+        ]
+
+    def run(self, args, *options):
+        """Run a command, returning its stderr"""
+        result = subprocess.run(
+            self.command(args, *options), env=self.env, check=True,
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        return result.stderr.decode("utf-8")
+
+
+def parse_importtime(output):
+    """Parse the output of -X importtime, returning (modules, total time)
+
+    Only the modules imported by the package are returned, not the ones
+    imported by the interpreter startup. Imports are reported after the
+    ones they trigger, indented below them."""
+    modules = set()
+    total = 0
+
+    nested = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue  # The header
+
+        nested.append(name.strip())
+        if name.startswith("  "):
+            continue
+
+        if name.strip().startswith("civ5_wallpapers"):
+            modules.update(nested)
+            total += int(cumulative)
+        nested = []
+
+    return modules, total / 1000000
+
+
+def latency(env, args, repeat):
+    """Get the best and median end-to-end latency of a command"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        env.run(args)
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+
+def build_argparse():
+    """Build the argparse instance"""
+    parser = argparse.ArgumentParser(prog="benchmarks.startup")
+    parser.add_argument("-r", "--repeat", type=int, default=20,
+                        help="Number of runs of every command")
+    parser.add_argument("--max-import-ms", type=float, default=None,
+                        help="Fail if importing the rotation entry point "
+                             "takes longer than this")
+    return parser
+
+
+def main():
+    """Run the startup benchmarks"""
+    args = build_argparse().parse_args()
+    failed = False
+
+    with tempfile.TemporaryDirectory(prefix="civ5-wallpapers-bench-") as tmp:
+        env = Environment(tmp)
+
+        print("%-20s %12s %12s %12s %8s" % (
+            "command", "imports", "best", "median", "modules",
+        ))
+        for name, command in COMMANDS:
+            # Warm up the bytecode cache before measuring anything
+            env.run(command)
+
+            modules, imports = parse_importtime(
+                env.run(command, "-X", "importtime")
+            )
+            best, median = latency(env, command, args.repeat)
+            print("%-20s %10.2fms %10.2fms %10.2fms %8s" % (
+                name, imports * 1000, best * 1000,
+                median * 1000, len(modules),
+            ))
+
+            if name != "rotate":
+                continue
+
+            for module in FORBIDDEN_MODULES:
+                if module in modules:
+                    print("Error: %s imports %s" % (name, module))
+                    failed = True
+
+            limit = args.max_import_ms
+            if limit is not None and imports * 1000 > limit:
+                print("Error: %s imports take more than %sms" % (name, limit))
+                failed = True
+
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
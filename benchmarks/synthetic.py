@@ -0,0 +1,117 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import random
+import struct
+import os
+
+from civ5_wallpapers import fpk
+from civ5_wallpapers import extractor
+
+
+DDS_BLOCK_SIZES = {
+    b"DXT1": 8,
+    b"DXT3": 16,
+    b"DXT5": 16,
+}
+
+
+def align(value):
+    """Align a value to 4 bytes"""
+    return value + (-value % 4)
+
+
+def write_pack(path, items, padding=0):
+    """Write a synthetic .fpk archive with the provided (name, data) items
+
+    Every item has ``padding`` extra zero bytes after its name, to exercise
+    the header validation of FpkArchive."""
+    items = list(items)
+    names = [name.encode("utf-8") for name, _ in items]
+
+    # The data starts right after the aligned end of the index
+    index_size = len(fpk.EXPECTED_MAGIC) + 4 + sum(
+        4 + len(name) + 4 + 4 + padding + 4 + 4 for name in names
+    )
+    offsets = []
+    offset = align(index_size)
+    for _, data in items:
+        offsets.append(offset)
+        offset = align(offset + len(data))
+
+    with open(path, "wb") as f:
+        f.write(fpk.EXPECTED_MAGIC)
+        f.write(struct.pack("<I", len(items)))
+        for name, (_, data), offset in zip(names, items, offsets):
+            f.write(struct.pack("<I", len(name)))
+            f.write(name)
+            f.write(struct.pack("<I", padding))
+            f.write(b"\x00" * (4 + padding))
+            f.write(struct.pack("<II", len(data), offset))
+
+        for (_, data), offset in zip(items, offsets):
+            f.write(b"\x00" * (offset - f.tell()))
+            f.write(data)
+
+
+def make_dds(width, height, fourcc=b"DXT1", mipmaps=1, seed=0):
+    """Create a synthetic .dds texture with random (but valid) blocks"""
+    rng = random.Random(seed)
+
+    levels = []
+    for level in range(mipmaps):
+        columns = (max(1, width >> level) + 3) // 4
+        rows = (max(1, height >> level) + 3) // 4
+        levels.append(rng.randbytes(columns * rows * DDS_BLOCK_SIZES[fourcc]))
+
+    flags = 0x1 | 0x2 | 0x4 | 0x1000 | 0x80000  # Required + linear size
+    if mipmaps > 1:
+        flags |= 0x20000
+    header = struct.pack(
+        "<4s7I44x", b"DDS ", 124, flags, height, width, len(levels[0]), 0,
+        mipmaps,
+    )
+    pixel_format = struct.pack("<2I4s5I", 32, 0x4, fourcc, 0, 0, 0, 0, 0)
+    caps = struct.pack("<4I4x", 0x1000 | (0x400008 if mipmaps > 1 else 0),
+                       0, 0, 0)
+
+    return header + pixel_format + caps + b"".join(levels)
+
+
+def wallpaper_items(count, width, height, fourcc=b"DXT1", mipmaps=1):
+    """Generate synthetic wallpapers, named like the game's ones"""
+    for i in range(count):
+        yield "loading_%s.dds" % i, make_dds(
+            width, height, fourcc, mipmaps, seed=i
+        )
+
+
+def filler_items(count, size, seed=0):
+    """Generate synthetic non-wallpaper items of random content"""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield "texture_%s.dds" % i, rng.randbytes(size)
+
+
+def make_game_dir(path, packs):
+    """Create a synthetic game resources directory
+
+    ``packs`` maps the file name of each pack to its (name, data) items."""
+    base = os.path.join(path, extractor.PACKS_DIR)
+    os.makedirs(base, exist_ok=True)
+
+    for name, items in packs.items():
+        write_pack(os.path.join(base, name), items)
+    return path
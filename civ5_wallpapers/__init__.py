@@ -13,4 +13,10 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from .extractor import extract_wallpapers
+# The extractor is imported only when it's used, so entry points that don't
+# need it (like civ5_wallpapers.rotate) start quickly
+def __getattr__(name):
+    if name == "extract_wallpapers":
+        from .extractor import extract_wallpapers
+        return extract_wallpapers
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
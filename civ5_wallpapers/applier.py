@@ -15,40 +15,173 @@
 
 import random
 import subprocess
+import json
 import os
 
+from . import session
 
-def get_random_wallpaper(directory):
-    """Get a random wallpaper"""
-    files = [file for file in os.listdir(directory) if file.endswith(".jpg")]
-    if not files:
+
+# Rotation state, relative to the wallpapers directory
+ROTATION_STATE = ".cache/rotation.json"
+
+DRM_DIR = "/sys/class/drm"
+
+# Extensions of the formats the wallpapers can be extracted to
+WALLPAPER_EXTENSIONS = (".jpg", ".png", ".webp")
+
+
+class ShuffleBag:
+    """Shuffled queue of the wallpapers in a directory
+
+    Every wallpaper is shown once before any of them is repeated. The
+    directory is listed again only when its mtime changes."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.state_file = os.path.join(directory, ROTATION_STATE)
+
+        self.mtime = None
+        self.files = []
+        self.queue = []
+        self.last = None
+
+        try:
+            with open(self.state_file) as f:
+                state = json.load(f)
+            self.mtime = state["mtime"]
+            self.files = state["files"]
+            self.queue = state["queue"]
+            self.last = state["last"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def refresh(self, force=False):
+        """Refresh the wallpapers index if the directory changed"""
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime and not force:
+            return
+
+        files = []
+        if mtime is not None:
+            files = sorted(
+                file for file in os.listdir(self.directory)
+                if file.endswith(WALLPAPER_EXTENSIONS)
+            )
+
+        # Keep the current queue, adding only the new wallpapers to it
+        existing = set(files)
+        known = set(self.files)
+        self.queue = [file for file in self.queue if file in existing]
+        for file in files:
+            if file not in known:
+                self.queue.insert(random.randint(0, len(self.queue)), file)
+
+        self.mtime = mtime
+        self.files = files
+
+    def next(self):
+        """Get the next wallpaper"""
+        self.refresh()
+        if not self.files:
+            return
+
+        if not self.queue:
+            self.queue = list(self.files)
+            random.shuffle(self.queue)
+
+            # Don't show the same wallpaper twice in a row between bags
+            if len(self.queue) > 1 and self.queue[-1] == self.last:
+                self.queue[0], self.queue[-1] = self.queue[-1], self.queue[0]
+
+        self.last = self.queue.pop()
+        return os.path.join(self.directory, self.last)
+
+    def save(self):
+        """Save the rotation state"""
+        try:
+            os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+            with open(self.state_file + ".tmp", "w") as f:
+                json.dump({
+                    "mtime": self.mtime,
+                    "files": self.files,
+                    "queue": self.queue,
+                    "last": self.last,
+                }, f)
+            os.replace(self.state_file + ".tmp", self.state_file)
+        except OSError:
+            pass  # The directory might be read-only
+
+
+def screen_resolution(drm_dir=DRM_DIR):
+    """Get the (width, height) of the main connected screen, if known
+
+    The preferred mode of the first connected output is read from sysfs,
+    without spawning any process."""
+    try:
+        connectors = sorted(os.listdir(drm_dir))
+    except OSError:
         return
 
-    return os.path.join(directory, random.choice(files))
+    for connector in connectors:
+        try:
+            with open(os.path.join(drm_dir, connector, "status")) as f:
+                if f.read().strip() != "connected":
+                    continue
+            with open(os.path.join(drm_dir, connector, "modes")) as f:
+                mode = f.readline().strip()
+        except OSError:
+            continue
 
+        width, _, height = mode.partition("x")
+        if width.isdigit() and height.isdigit():
+            return int(width), int(height)
 
-def set_gnome_wallpaper(wallpaper):
-    """Set a wallpaper in the GNOME desktop environment"""
+
+def resolution_variant(wallpaper, resolution):
+    """Get the variant of a wallpaper pre-scaled to a resolution, if any"""
+    if resolution is None:
+        return wallpaper
+
+    directory, name = os.path.split(wallpaper)
+    variant = os.path.join(directory, "%sx%s" % resolution, name)
+    if os.path.exists(variant):
+        return variant
+    return wallpaper
+
+
+def get_random_wallpaper(directory, resolution=None):
+    """Get a random wallpaper, without repeating them until all were shown
+
+    If a resolution is provided and the wallpaper was extracted scaled to
+    it, the scaled variant is returned."""
+    bag = ShuffleBag(directory)
+    wallpaper = bag.next()
+    bag.save()
+
+    if wallpaper is None:
+        return
+    return resolution_variant(wallpaper, resolution)
+
+
+def session_env():
+    """Get the environment needed to talk with the desktop session"""
     env = os.environ.copy()
 
     # Fix cron support -- it doesn't have access to $DBUS_SESSION_BUS_ADDRESS
     # http://askubuntu.com/questions/403918/setting-cron-to-run-a-shell-script-random-wallpaper-from-a-webpage
     if "DBUS_SESSION_BUS_ADDRESS" not in env:
-        # Get the PID of gnome-session
-        pid_raw, _ = subprocess.Popen(
-            ["pgrep", "gnome-session"],
-            stdout=subprocess.PIPE, stderr=subprocess.STDOUT
-        ).communicate()
-        pid = pid_raw.decode("ascii").strip()
-
-        # Get $DBUS_SESSION_BUS_ADDRESS from the gnome-session environ
-        with open(os.path.join("/proc", pid, "environ")) as f:
-            session_env = dict(
-                l.split("=", 1) for l in f.read().split("\0") if l.count("=")
-            )
+        env["DBUS_SESSION_BUS_ADDRESS"] = session.find_bus_address()
 
-        # Set the correct $DBUS_SESSION_BUS_ADDRESS
-        env["DBUS_SESSION_BUS_ADDRESS"] = session_env["DBUS_SESSION_BUS_ADDRESS"]
+    return env
+
+
+def set_gnome_wallpaper(wallpaper, env=None):
+    """Set a wallpaper in the GNOME desktop environment"""
+    if env is None:
+        env = session_env()
 
     subprocess.call([
         "gsettings", "set",
@@ -57,10 +190,13 @@ def set_gnome_wallpaper(wallpaper):
     ], env=env)
 
 
-def set_wallpaper(de, wallpaper):
-    """Set a wallpaper in the current desktop environment"""
+def set_wallpaper(de, wallpaper, env=None):
+    """Set a wallpaper in the current desktop environment
+
+    The environment returned by session_env() can be provided, to avoid
+    looking for the desktop session every time."""
     if de == "gnome" or de == "unity":
-        set_gnome_wallpaper(wallpaper)
+        set_gnome_wallpaper(wallpaper, env)
     else:
         return False
 
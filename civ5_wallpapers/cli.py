@@ -19,12 +19,16 @@ import sys
 import subprocess
 import argparse
 
-from .extractor import extract_wallpapers
-from .applier import get_random_wallpaper, set_wallpaper, supported_des
+from . import rotate
+from . import store
+from .applier import supported_des
+
+# The modules needed only by some commands are imported by them, to keep
+# the startup time low
 
 
 DEFAULT_STEAM_DIR = "~/.steam/root/steamapps/common/Sid Meier's Civilization V/steamassets"
-DEFAULT_OUTPUT_DIR = "~/.cache/civ5-wallpapers"
+DEFAULT_OUTPUT_DIR = rotate.DEFAULT_OUTPUT_DIR
 
 GITHUB_URL = "https://github.com/pietroalbini/civ5-wallpapers"
 ASK_MAP = {
@@ -34,10 +38,23 @@ ASK_MAP = {
 
 
 cron_re = re.compile(
-    r"^.* .* .* .* .* (.*)?python(.*)? \-m civ5_wallpapers "
-    r"set\-random [a-z]+ \>\/dev\/null 2\>\&1$"
+    r"^.* .* .* .* .* (.*)?python(.*)? \-m civ5_wallpapers"
+    r"( set\-random|\.rotate) [a-z]+ \>\/dev\/null 2\>\&1$"
 )
 
+resolution_re = re.compile(r"^([1-9][0-9]*)x([1-9][0-9]*)$")
+
+
+def resolutions_list(value):
+    """Parse a comma-separated list of WIDTHxHEIGHT resolutions"""
+    resolutions = []
+    for item in value.split(","):
+        match = resolution_re.match(item.strip())
+        if match is None:
+            raise argparse.ArgumentTypeError("invalid resolution: %s" % item)
+        resolutions.append((int(match.group(1)), int(match.group(2))))
+    return resolutions
+
 
 def ask(question, default=None):
     """Ask a y/n question"""
@@ -57,12 +74,51 @@ def ask(question, default=None):
             return default
 
 
+def find_game_dirs():
+    """Find the resources directories of the game installed with Steam"""
+    from . import steam
+
+    game_dirs = steam.find_resource_dirs()
+    if not game_dirs:
+        game_dirs = [os.path.expanduser(DEFAULT_STEAM_DIR)]
+    return game_dirs
+
+
 def cmd_extract(args):
     """Extract wallpapers from the game files"""
-    game_dir = os.path.expanduser(args.game_dir)
-    output = os.path.expanduser(args.output)
+    from .extractor import extract_wallpapers
+    from .extractor import ConversionSettings
+    from .fpk import FpkError
+    from .stats import Stats, Progress
+
+    if args.game_dir is None:
+        game_dirs = find_game_dirs()
+    else:
+        game_dirs = [os.path.expanduser(args.game_dir)]
+    game_dir = game_dirs[0]
 
-    os.makedirs(output, exist_ok=True)
+    if args.system:
+        if args.output is not None:
+            print("Error: --system and --output can't be used together")
+            exit(1)
+        output = store.SYSTEM_DIR
+
+        # Every user must be able to read the shared wallpapers
+        os.umask(0o022)
+    else:
+        output = os.path.expanduser(args.output or DEFAULT_OUTPUT_DIR)
+
+    try:
+        os.makedirs(output, exist_ok=True)
+    except PermissionError:
+        print("Error: can't write to the '%s' directory!" % output)
+        if args.system:
+            print("The system-wide store must be populated as root.")
+        exit(1)
+
+    if args.jobs < 1:
+        print("Error: the number of jobs must be at least 1")
+        exit(1)
 
     if not os.path.exists(game_dir):
         print(
@@ -79,7 +135,53 @@ def cmd_extract(args):
 
         exit(1)
 
-    result = extract_wallpapers(game_dir, output)
+    patterns = None
+    if args.all:
+        patterns = ["*"]
+    elif args.patterns:
+        patterns = args.patterns
+
+    if args.read_ahead < 0:
+        print("Error: the read-ahead window can't be negative")
+        exit(1)
+
+    if args.quality is not None and not 1 <= args.quality <= 100:
+        print("Error: the quality must be between 1 and 100")
+        exit(1)
+    if args.format == "png" and args.quality is not None:
+        print("Error: PNG images are lossless, they have no quality")
+        exit(1)
+    if args.format == "png" and args.max_size is not None:
+        print("Error: the size of lossless PNG images can't be limited")
+        exit(1)
+    if args.progressive and args.format != "jpg":
+        print("Error: only JPG images can be progressive")
+        exit(1)
+    if args.max_size is not None and args.max_size <= 0:
+        print("Error: the maximum size must be positive")
+        exit(1)
+
+    max_size = None
+    if args.max_size is not None:
+        max_size = int(args.max_size * 1024)
+    settings = ConversionSettings(
+        args.resolutions, args.format, args.quality, args.progressive,
+        args.optimize, max_size,
+    )
+
+    stats = Stats()
+    try:
+        result = extract_wallpapers(
+            game_dirs, output, args.jobs, args.resolutions, stats, patterns,
+            Progress(), int(args.read_ahead * 1024 * 1024), settings,
+        )
+    except FpkError as e:
+        print("Error: a game file is corrupted: %s" % e)
+        print("Check the integrity of the game files with Steam.")
+        exit(1)
+    if args.stats is not None:
+        print(stats.report(args.stats))
+
     if not result:
         print("Error: no game files found in the '%s' directory" % game_dir)
 
@@ -93,30 +195,108 @@ def cmd_extract(args):
         exit(1)
 
 
+def cmd_verify(args):
+    """Verify the integrity of the game files and of the wallpapers"""
+    from .verify import verify
+    from .stats import Stats, MB, throughput
+
+    if args.game_dir is None:
+        game_dirs = find_game_dirs()
+    else:
+        game_dirs = [os.path.expanduser(args.game_dir)]
+    output = os.path.expanduser(args.output)
+
+    if args.jobs < 1:
+        print("Error: the number of jobs must be at least 1")
+        exit(1)
+
+    stats = Stats()
+    problems = verify(game_dirs, output, args.jobs, stats)
+
+    for pack, pack_stats in sorted(stats.packs.items()):
+        print("%s: %s members, %.1f MB, %.1f MB/s" % (
+            pack, pack_stats["members"], pack_stats["bytes"] / MB,
+            throughput(pack_stats) / MB,
+        ))
+    if args.stats is not None:
+        print(stats.report(args.stats))
+
+    if not stats.packs and not problems:
+        print("Error: no game files found in the '%s' directory"
+              % game_dirs[0])
+        exit(1)
+
+    for problem in problems:
+        print("Error: %s" % problem)
+    if problems:
+        exit(1)
+
+    print("Everything is fine!")
+
+
 def cmd_set_random(args):
     """Set a random wallpaper"""
-    de = args.de
-    directory = os.path.expanduser(args.directory)
+    rotate.set_random(args.de, args.directory)
+
+
+def cmd_daemon(args):
+    """Rotate wallpapers from a long-running process"""
+    from . import daemon
+
+    directory = rotate.wallpapers_directory(args.directory)
+
+    if args.interval <= 0:
+        print("Error: the interval must be greater than 0!")
+        exit(1)
 
     if not os.path.exists(directory):
-        print("Error: directory '%s' doesn't exist!")
+        print("Error: directory '%s' doesn't exist!" % directory)
         if os.path.expanduser(DEFAULT_OUTPUT_DIR) == directory:
             print("Please extract the wallpapers from Civilization 5 with:")
             print("$ civ5-wallpapers extract")
         exit(1)
 
-    wallpaper = get_random_wallpaper(directory)
-    if wallpaper is None:
+    daemon.run(args.de, directory, args.interval * 60)
+
+
+def cmd_slideshow(args):
+    """Let the desktop environment rotate the wallpapers by itself"""
+    from . import slideshow
+    from .applier import set_wallpaper
+
+    directory = rotate.wallpapers_directory(args.directory)
+
+    if args.interval <= 0:
+        print("Error: the interval must be greater than 0!")
+        exit(1)
+    if args.transition < 0:
+        print("Error: the transition can't be negative!")
+        exit(1)
+
+    if not os.path.exists(directory):
+        print("Error: directory '%s' doesn't exist!" % directory)
+        if os.path.expanduser(DEFAULT_OUTPUT_DIR) == directory:
+            print("Please extract the wallpapers from Civilization 5 with:")
+            print("$ civ5-wallpapers extract")
+        exit(1)
+
+    path = slideshow.update(directory, args.interval, args.transition)
+    if not slideshow.load_state(directory)["order"]:
         print("Error: no wallpapers found in '%s'!" % directory)
         exit(1)
 
-    if not set_wallpaper(de, wallpaper):
-        print("Unsupported desktop environment: %s" % de)
+    if not set_wallpaper(args.de, path):
+        print("Unsupported desktop environment: %s" % args.de)
         exit(1)
 
 
 def cmd_setup(args):
     """User-friendly setup"""
+    from . import slideshow
+    from .extractor import extract_wallpapers
+    from .applier import get_random_wallpaper, set_wallpaper, \
+                         screen_resolution
+
     def abort():
         print("Aborted!")
         exit(1)
@@ -124,41 +304,51 @@ def cmd_setup(args):
     print("This is an interactive setup for civ5-wallpapers.")
     print()
 
-    game_dir = os.path.expanduser(DEFAULT_STEAM_DIR)
-    if not os.path.exists(game_dir):
-        print("I can't find a Steam installation of Civilization V.")
-        print("Remember you must have a legit copy of the game somewhere.")
-
-        while True:
-            print()
-            if not ask("Do you want to enter a custom resources directory?",
-                       default=True):
-                abort()
-
-            game_dir = os.path.expanduser(input("Game resources directory: "))
-            if os.path.exists(game_dir):
-                break
-
-            print("The path you provided doesn't exist!")
+    # On shared machines the wallpapers might be already extracted for all
+    # the users, there's no need to extract them again
+    output = os.path.expanduser(DEFAULT_OUTPUT_DIR)
+    if store.update_view(output, create=True):
+        print("The wallpapers were already extracted for all the users in: %s"
+              % store.SYSTEM_DIR)
     else:
-        print("A Steam installation of the game was automatically located.")
-        print("Resources directory: %s" % game_dir)
+        game_dirs = find_game_dirs()
+        if not os.path.exists(game_dirs[0]):
+            print("I can't find a Steam installation of Civilization V.")
+            print("Remember you must have a legit copy of the game somewhere.")
+
+            while True:
+                print()
+                if not ask("Do you want to enter a custom resources "
+                           "directory?", default=True):
+                    abort()
+
+                game_dir = os.path.expanduser(
+                    input("Game resources directory: ")
+                )
+                if os.path.exists(game_dir):
+                    game_dirs = [game_dir]
+                    break
+
+                print("The path you provided doesn't exist!")
+        else:
+            print("A Steam installation of the game was automatically "
+                  "located.")
+            for game_dir in game_dirs:
+                print("Resources directory: %s" % game_dir)
 
-    print()
-    print("Extracting wallpapers in: %s"
-          % os.path.expanduser("~/.cache/civ5-wallpapers"))
-    print("Please wait. It should take just a few seconds...")
+        print()
+        print("Extracting wallpapers in: %s" % output)
+        print("Please wait. It should take just a few seconds...")
 
-    result = extract_wallpapers(
-        game_dir, os.path.expanduser(DEFAULT_OUTPUT_DIR)
-    )
+        result = extract_wallpapers(game_dirs, output)
 
-    if not result:
-        print()
-        print("Error: can't find the right game files in the game directory.")
-        print("Please make sure the 'resources/dx9/uitextures.fpk' file "
-              "exists in there!")
-        abort()
+        if not result:
+            print()
+            print("Error: can't find the right game files in the game "
+                  "directory.")
+            print("Please make sure the 'resources/dx9/uitextures.fpk' file "
+                  "exists in there!")
+            abort()
 
     print()
     should_cron = ask("Would you like to automatically rotate wallpapers?")
@@ -189,6 +379,39 @@ def cmd_setup(args):
 
         break
 
+    print()
+    print("How do you want to rotate wallpapers?")
+    print("1) Let the desktop environment rotate them (recommended)")
+    print("2) Change them periodically with cron")
+
+    while True:
+        reply = input("> ").strip()
+        if reply in ("1", "2"):
+            break
+
+    if reply == "1":
+        print()
+        print("When do you want to rotate wallpapers?")
+        print("1) Every 15 minutes")
+        print("2) Every hour")
+        print("3) Every day")
+
+        intervals = {"1": 15, "2": 60, "3": 60 * 24}
+        while True:
+            reply = input("> ").strip()
+            if reply in intervals:
+                break
+
+        path = slideshow.update(
+            os.path.expanduser(DEFAULT_OUTPUT_DIR), intervals[reply]
+        )
+        set_wallpaper(de, path)
+
+        print()
+        print("You're ready to go! Thank you for using civ5-wallpapers.")
+        print("#OneMoreTurn")
+        return
+
     print()
     print("When do you want to rotate wallpapers?")
     print("1) Every 15 minutes")
@@ -215,7 +438,7 @@ def cmd_setup(args):
 
     # Generate the crontab entry
     crontab_entry = (
-        "%s %s -m civ5_wallpapers set-random %s >/dev/null 2>&1"
+        "%s %s -m civ5_wallpapers.rotate %s >/dev/null 2>&1"
         % (cron, sys.executable, de)
     )
 
@@ -252,7 +475,7 @@ def cmd_setup(args):
 
     # Change the wallpaper
     random_wallpaper = get_random_wallpaper(
-        os.path.expanduser(DEFAULT_OUTPUT_DIR)
+        os.path.expanduser(DEFAULT_OUTPUT_DIR), screen_resolution()
     )
     if random_wallpaper:
         set_wallpaper(de, random_wallpaper)
@@ -268,10 +491,62 @@ def build_argparse():
     sub = parser.add_subparsers(title="Available commands", dest="cmd")
 
     extract_cmd = sub.add_parser("extract", help="Extract wallpapers")
-    extract_cmd.add_argument("--game-dir", default=DEFAULT_STEAM_DIR,
-                             help="Game resources directory")
-    extract_cmd.add_argument("-o", "--output", default=DEFAULT_OUTPUT_DIR,
-                             help="Wallpapers output directory")
+    extract_cmd.add_argument("--game-dir",
+                             help="Game resources directory (by default "
+                                  "found in the Steam libraries)")
+    extract_cmd.add_argument("-o", "--output", default=None,
+                             help="Wallpapers output directory (by default "
+                                  "%s)" % DEFAULT_OUTPUT_DIR)
+    extract_cmd.add_argument("--system", action="store_true",
+                             help="Extract the wallpapers for all the users, "
+                                  "in %s" % store.SYSTEM_DIR)
+    extract_cmd.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                             help="Number of parallel jobs")
+    extract_cmd.add_argument("--resolutions", type=resolutions_list,
+                             default=[], metavar="WxH,...",
+                             help="Also generate wallpapers scaled to these "
+                                  "resolutions")
+    extract_cmd.add_argument("--stats", nargs="?", const="text",
+                             choices=["text", "json"],
+                             help="Show timing and throughput statistics")
+    extract_cmd.add_argument("--pattern", action="append", dest="patterns",
+                             metavar="GLOB",
+                             help="Extract the files matching this glob "
+                                  "instead of the loading screens (can be "
+                                  "repeated)")
+    extract_cmd.add_argument("--all", action="store_true",
+                             help="Extract all the files of the game packs")
+    extract_cmd.add_argument("--read-ahead", type=float, default=64,
+                             metavar="MB",
+                             help="How much of the game files to read ahead "
+                                  "of time")
+    extract_cmd.add_argument("--format", choices=["jpg", "png", "webp"],
+                             default="jpg", help="Format of the wallpapers")
+    extract_cmd.add_argument("--quality", type=int, default=None,
+                             help="Quality of the wallpapers, from 1 to 100 "
+                                  "(by default 92 for JPG and 90 for WebP)")
+    extract_cmd.add_argument("--progressive", action="store_true",
+                             help="Save progressive JPG images")
+    extract_cmd.add_argument("--optimize", action="store_true",
+                             help="Spend more time to make the wallpapers "
+                                  "smaller")
+    extract_cmd.add_argument("--max-size", type=float, default=None,
+                             metavar="KB",
+                             help="Lower the quality of the wallpapers "
+                                  "until they fit in this size")
+
+    verify_cmd = sub.add_parser("verify", help="Verify the game files and "
+                                               "the extracted wallpapers")
+    verify_cmd.add_argument("--game-dir",
+                            help="Game resources directory (by default "
+                                 "found in the Steam libraries)")
+    verify_cmd.add_argument("-o", "--output", default=DEFAULT_OUTPUT_DIR,
+                            help="Wallpapers output directory")
+    verify_cmd.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                            help="Number of parallel jobs")
+    verify_cmd.add_argument("--stats", nargs="?", const="text",
+                            choices=["text", "json"],
+                            help="Show timing and throughput statistics")
 
     set_random_cmd = sub.add_parser("set-random",
                                     help="Set a random wallpaper")
@@ -281,6 +556,29 @@ def build_argparse():
     set_random_cmd.add_argument("de", choices=supported_des(),
                                 help="Wallpapers output directory")
 
+    daemon_cmd = sub.add_parser("daemon",
+                                help="Rotate wallpapers in the background")
+    daemon_cmd.add_argument("-d", "--directory", default=DEFAULT_OUTPUT_DIR,
+                            help="Wallpapers directory")
+    daemon_cmd.add_argument("-i", "--interval", type=float, default=60,
+                            help="Minutes between each rotation")
+    daemon_cmd.add_argument("de", choices=supported_des(),
+                            help="Desktop environment")
+
+    slideshow_cmd = sub.add_parser("slideshow",
+                                   help="Let the desktop environment "
+                                        "rotate wallpapers")
+    slideshow_cmd.add_argument("-d", "--directory",
+                               default=DEFAULT_OUTPUT_DIR,
+                               help="Wallpapers directory")
+    slideshow_cmd.add_argument("-i", "--interval", type=float, default=60,
+                               help="Minutes between each rotation")
+    slideshow_cmd.add_argument("-t", "--transition", type=float, default=5,
+                               help="Seconds of the transition between "
+                                    "wallpapers")
+    slideshow_cmd.add_argument("de", choices=supported_des(),
+                               help="Desktop environment")
+
     setup_cmd = sub.add_parser("setup", help="User-friendy setup")
 
     return parser
@@ -293,8 +591,14 @@ def main():
 
     if args.cmd == "extract":
         cmd_extract(args)
+    elif args.cmd == "verify":
+        cmd_verify(args)
     elif args.cmd == "set-random":
         cmd_set_random(args)
+    elif args.cmd == "daemon":
+        cmd_daemon(args)
+    elif args.cmd == "slideshow":
+        cmd_slideshow(args)
     elif args.cmd == "setup":
         cmd_setup(args)
     else:
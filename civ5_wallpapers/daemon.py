@@ -0,0 +1,74 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import signal
+
+from . import applier
+from . import store
+
+
+async def rotate(de, directory, interval):
+    """Rotate the wallpaper every ``interval`` seconds until stopped
+
+    SIGHUP reloads the wallpapers list and the desktop session, and changes
+    the wallpaper immediately. SIGINT and SIGTERM stop the rotation. If
+    the directory is a view of the system-wide store, it's synced with it
+    before every change."""
+    loop = asyncio.get_running_loop()
+
+    wallpapers = applier.ShuffleBag(directory)
+    env = applier.session_env()
+
+    reload = asyncio.Event()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGHUP, reload.set)
+    loop.add_signal_handler(signal.SIGINT, stop.set)
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+
+    while not stop.is_set():
+        if reload.is_set():
+            reload.clear()
+            wallpapers.refresh(force=True)
+            env = applier.session_env()
+
+        # The list is refreshed by itself when a view gains or loses links
+        store.update_view(directory)
+
+        wallpaper = wallpapers.next()
+        wallpapers.save()
+        if wallpaper is not None:
+            wallpaper = applier.resolution_variant(
+                wallpaper, applier.screen_resolution()
+            )
+            await loop.run_in_executor(
+                None, applier.set_wallpaper, de, wallpaper, env
+            )
+
+        # Sleep until the next rotation or until a signal is received
+        waiters = [
+            asyncio.ensure_future(reload.wait()),
+            asyncio.ensure_future(stop.wait()),
+        ]
+        _, pending = await asyncio.wait(
+            waiters, timeout=interval, return_when=asyncio.FIRST_COMPLETED
+        )
+        for waiter in pending:
+            waiter.cancel()
+
+
+def run(de, directory, interval):
+    """Run the rotation daemon"""
+    asyncio.run(rotate(de, directory, interval))
@@ -0,0 +1,259 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import struct
+
+import numpy
+
+
+DDS_MAGIC = b"DDS "
+HEADER_SIZE = 4 + 124
+
+DDPF_FOURCC = 0x4
+
+# Size in bytes of a 4x4 block for every supported format
+BLOCK_SIZES = {
+    b"DXT1": 8,
+    b"DXT3": 16,
+    b"DXT5": 16,
+}
+
+
+# Rows of 4x4 blocks decoded at a time by decode_bands()
+BAND_ROWS = 8
+
+
+class DdsError(Exception):
+    pass
+
+
+class UnsupportedFormat(DdsError):
+    pass
+
+
+class DdsHeader:
+    """This class represents the header of a .dds texture"""
+
+    def __init__(self, data):
+        if len(data) < HEADER_SIZE:
+            raise DdsError("Truncated header")
+
+        magic, size, _, height, width = struct.unpack_from("<4s4I", data, 0)
+        if magic != DDS_MAGIC:
+            raise DdsError("Wrong magic string: %s" % magic)
+        if size != 124:
+            raise DdsError("Wrong header size: %s" % size)
+        if not width or not height:
+            raise DdsError("Empty texture")
+
+        self.width = width
+        self.height = height
+        self.mipmaps = max(1, struct.unpack_from("<I", data, 28)[0])
+
+        pf_flags, fourcc = struct.unpack_from("<I4s", data, 80)
+        if not pf_flags & DDPF_FOURCC:
+            raise UnsupportedFormat("Uncompressed textures are not supported")
+        if fourcc not in BLOCK_SIZES:
+            raise UnsupportedFormat("Unsupported format: %s" % fourcc)
+        self.fourcc = fourcc
+
+    def level_dimensions(self, level):
+        """Get the (width, height) of a mipmap level"""
+        return max(1, self.width >> level), max(1, self.height >> level)
+
+    def level_blocks(self, level):
+        """Get the number of (columns, rows) of blocks of a mipmap level"""
+        width, height = self.level_dimensions(level)
+        return (width + 3) // 4, (height + 3) // 4
+
+    def best_level(self, width, height):
+        """Get the smallest mipmap level big enough to fill a size
+
+        The image is considered scaled keeping its aspect ratio."""
+        scale = max(width / self.width, height / self.height)
+
+        level = 0
+        while level + 1 < self.mipmaps:
+            level_width, level_height = self.level_dimensions(level + 1)
+            if (level_width < self.width * scale
+                    or level_height < self.height * scale):
+                break
+            level += 1
+        return level
+
+    def level_offset(self, level):
+        """Get the offset of a mipmap level from the start of the file"""
+        if not 0 <= level < self.mipmaps:
+            raise DdsError("Mipmap level %s not present" % level)
+
+        offset = HEADER_SIZE
+        for previous in range(level):
+            columns, rows = self.level_blocks(previous)
+            offset += columns * rows * BLOCK_SIZES[self.fourcc]
+        return offset
+
+
+def expand_565(colors):
+    """Expand RGB565 colors into an array of 8-bit RGB channels"""
+    colors = colors.astype(numpy.uint16)
+    r = (colors >> 11) & 0x1f
+    g = (colors >> 5) & 0x3f
+    b = colors & 0x1f
+    return numpy.stack([
+        (r << 3) | (r >> 2),
+        (g << 2) | (g >> 4),
+        (b << 3) | (b >> 2),
+    ], axis=-1)
+
+
+def decode_colors(blocks, punch_through):
+    """Decode the BC1 color part of some blocks into (..., 16, 4) pixels"""
+    colors = blocks[..., :4].copy().view("<u2")
+    c0 = colors[..., 0]
+    c1 = colors[..., 1]
+    p0 = expand_565(c0).astype(numpy.int32)
+    p1 = expand_565(c1).astype(numpy.int32)
+
+    # Build the 4 colors palette of every block, with the alpha channel
+    palette = numpy.empty(blocks.shape[:-1] + (4, 4), dtype=numpy.int32)
+    palette[..., 3] = 255
+    palette[..., 0, :3] = p0
+    palette[..., 1, :3] = p1
+    palette[..., 2, :3] = (2 * p0 + p1) // 3
+    palette[..., 3, :3] = (p0 + 2 * p1) // 3
+
+    # BC1 blocks with c0 <= c1 have only 3 colors, plus a transparent black
+    if punch_through:
+        three = c0 <= c1
+        palette[three, 2, :3] = (p0[three] + p1[three]) // 2
+        palette[three, 3] = 0
+
+    bits = blocks[..., 4:8].copy().view("<u4")
+    shifts = numpy.arange(16, dtype=numpy.uint32) * 2
+    indices = ((bits >> shifts) & 3).astype(numpy.intp)
+
+    pixels = numpy.take_along_axis(palette, indices[..., None], axis=-2)
+    return pixels.astype(numpy.uint8)
+
+
+def decode_explicit_alpha(blocks):
+    """Decode the BC2 alpha part of some blocks into (..., 16) values"""
+    bits = blocks[..., :8].copy().view("<u8")
+    shifts = numpy.arange(16, dtype=numpy.uint64) * 4
+    return (((bits >> shifts) & 0xf) * 17).astype(numpy.uint8)
+
+
+def decode_interpolated_alpha(blocks):
+    """Decode the BC3 alpha part of some blocks into (..., 16) values"""
+    a0 = blocks[..., 0].astype(numpy.int32)
+    a1 = blocks[..., 1].astype(numpy.int32)
+
+    # Build the 8 values palette of every block
+    palette = numpy.empty(blocks.shape[:-1] + (8,), dtype=numpy.int32)
+    palette[..., 0] = a0
+    palette[..., 1] = a1
+    for i in range(1, 7):
+        palette[..., i + 1] = ((7 - i) * a0 + i * a1) // 7
+
+    six = a0 <= a1
+    for i in range(1, 5):
+        palette[six, i + 1] = ((5 - i) * a0[six] + i * a1[six]) // 5
+    palette[six, 6] = 0
+    palette[six, 7] = 255
+
+    # The 48 bits of indices are padded to 64 bits to be read at once
+    raw = numpy.zeros(blocks.shape[:-1] + (8,), dtype=numpy.uint8)
+    raw[..., :6] = blocks[..., 2:8]
+    bits = raw.view("<u8")
+    shifts = numpy.arange(16, dtype=numpy.uint64) * 3
+    indices = ((bits >> shifts) & 7).astype(numpy.intp)
+
+    return numpy.take_along_axis(palette, indices, axis=-1).astype(numpy.uint8)
+
+
+def decode_blocks(fourcc, blocks):
+    """Decode an array of (..., block size) blocks into (..., 16, 4) pixels"""
+    if fourcc == b"DXT1":
+        return decode_colors(blocks, punch_through=True)
+
+    pixels = decode_colors(blocks[..., 8:], punch_through=False)
+    if fourcc == b"DXT3":
+        pixels[..., 3] = decode_explicit_alpha(blocks)
+    else:
+        pixels[..., 3] = decode_interpolated_alpha(blocks)
+    return pixels
+
+
+def block_array(data, header, level=0):
+    """Get the blocks of a mipmap level, without copying them
+
+    The blocks are returned as a (rows, columns, block size) array."""
+    columns, rows = header.level_blocks(level)
+    block_size = BLOCK_SIZES[header.fourcc]
+
+    offset = header.level_offset(level)
+    if offset + columns * rows * block_size > len(data):
+        raise DdsError("Truncated texture data")
+
+    return numpy.frombuffer(
+        data, dtype=numpy.uint8, count=columns * rows * block_size,
+        offset=offset,
+    ).reshape(rows, columns, block_size)
+
+
+def decode_block_rows(fourcc, blocks):
+    """Decode (rows, columns, block size) blocks into an RGBA image"""
+    rows, columns = blocks.shape[:2]
+
+    # Rearrange the (rows, columns, 4 * 4 pixels) into the final image
+    pixels = decode_blocks(fourcc, blocks)
+    image = pixels.reshape(rows, columns, 4, 4, 4).transpose(0, 2, 1, 3, 4)
+    return image.reshape(rows * 4, columns * 4, 4)
+
+
+def decode(data, level=0):
+    """Decode a .dds texture into an RGBA array of shape (height, width, 4)
+
+    Only the DXT1, DXT3 and DXT5 block formats are supported: other formats
+    raise UnsupportedFormat."""
+    header = DdsHeader(data)
+    width, height = header.level_dimensions(level)
+
+    # Only the output is allocated for the whole image: the palettes and
+    # the indices are built for a band at a time
+    image = numpy.empty((height, width, 4), dtype=numpy.uint8)
+    top = 0
+    for band in decode_bands(data, level):
+        image[top:top + len(band)] = band
+        top += len(band)
+    return image
+
+
+def decode_bands(data, level=0, rows=BAND_ROWS):
+    """Decode a .dds texture one band of ``rows`` rows of blocks at a time
+
+    An iterator over RGBA arrays of shape (band height, width, 4) is
+    returned, from the top of the image: only the band being decoded is
+    kept in memory. The texture is validated before returning."""
+    header = DdsHeader(data)
+    width, height = header.level_dimensions(level)
+    blocks = block_array(data, header, level)
+
+    return (
+        decode_block_rows(
+            header.fourcc, blocks[start:start + rows]
+        )[:height - start * 4, :width]
+        for start in range(0, len(blocks), rows)
+    )
@@ -13,66 +13,896 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import concurrent.futures
+import contextlib
+import asyncio
+import fnmatch
+import fcntl
+import time
+import shutil
+import io
 import os
-import tempfile
-import re
 import subprocess
 
 from . import fpk
+from . import ioplan
+from . import manifest
+from . import packset
+from . import slideshow
+from . import store
+from .stats import Stats
+
+# The in-process decoder needs the optional numpy and Pillow dependencies
+try:
+    import PIL.Image
+    from . import dds
+except ImportError:
+    dds = None
 
 
 PACKS_DIR = "resource/dx9"
 PACKS_SUFFIX = "uitextures.fpk"
 
-WALLPAPER_PATTERNS = [
-    re.compile(r"^loading_[0-9]+\.dds$")
-]
+# Directory (inside the output one) containing the extractor's caches
+CACHE_DIR = ".cache"
 
+# Held while extracting, so concurrent extractions into the same directory
+# (for example the system-wide one) wait for each other
+LOCK_FILE = os.path.join(CACHE_DIR, "extract.lock")
 
-def find_packs(resources_dir):
-    """Find Civ5's UI textures packs from a Steam directory"""
-    base = os.path.join(resources_dir, PACKS_DIR)
-    if os.path.exists(base):
-        for file in os.listdir(base):
-            if file.endswith(PACKS_SUFFIX):
-                yield os.path.join(base, file)
+# The loading screens are "loading_" followed by a number: the glob finds the
+# candidates in the index, and is_wallpaper() checks the number
+WALLPAPER_PATTERN = "loading_*.dds"
 
+JPEG_QUALITY = 92
 
-def extract_pack(path, dest):
-    """Extract wallpapers from a single .fpk file"""
-    pack = fpk.open(path)
+# Formats the wallpapers can be encoded to, with the name Pillow uses for
+# them and their default quality (None for the lossless ones)
+OUTPUT_FORMATS = {
+    "jpg": ("JPEG", JPEG_QUALITY),
+    "png": ("PNG", None),
+    "webp": ("WEBP", 90),
+}
+
+# Wallpapers are sent to the worker processes in batches of up to this many
+# members, to amortize the cost of each task when extracting many of them
+BATCH_SIZE = 32
+
+
+def find_packs(resources_dirs):
+    """Find Civ5's UI textures packs from one or more resources directories"""
+    if isinstance(resources_dirs, str):
+        resources_dirs = [resources_dirs]
 
+    for resources_dir in resources_dirs:
+        try:
+            with os.scandir(os.path.join(resources_dir, PACKS_DIR)) as files:
+                paths = sorted(
+                    file.path for file in files
+                    if file.name.endswith(PACKS_SUFFIX) and file.is_file()
+                )
+        except FileNotFoundError:
+            continue
+        yield from paths
+
+
+def is_wallpaper(file):
+    """Check if a member is one of the loading screens"""
+    if not fnmatch.fnmatchcase(file, WALLPAPER_PATTERN):
+        return False
+    number = file[len("loading_"):-len(".dds")]
+    return number.isascii() and number.isdigit()
+
+
+def wallpaper_names(pack):
+    """Get the names of the wallpapers contained in a pack"""
     for file in pack.files():
-        for pattern in WALLPAPER_PATTERNS:
-            if not pattern.match(file):
+        if is_wallpaper(file) and fpk.is_safe_name(file):
+            yield file
+
+
+class ConversionSettings:
+    """Settings affecting the conversion of the wallpapers
+
+    Besides the native size, wallpapers can be converted to some
+    additional (width, height) resolutions, each one stored in its own
+    subdirectory of the output directory.
+
+    If ``max_size`` is set, the quality of every image is lowered as much
+    as needed to make it fit in that many bytes."""
+
+    def __init__(self, resolutions=(), format="jpg", quality=None,
+                 progressive=False, optimize=False, max_size=None):
+        if format not in OUTPUT_FORMATS:
+            raise ValueError("unsupported format: %s" % format)
+
+        self.format = format
+        self.quality = quality
+        if quality is None:
+            self.quality = OUTPUT_FORMATS[format][1]
+        self.progressive = progressive
+        self.optimize = optimize
+        self.max_size = max_size
+        self.resolutions = sorted(set(resolutions))
+
+    def manifest(self):
+        """Get the settings as recorded in the manifest"""
+        return {
+            "decoder": "numpy" if dds is not None else "imagemagick",
+            "encoder": encoder_name(self),
+            "format": self.format,
+            "quality": self.quality,
+            "progressive": self.progressive,
+            "optimize": self.optimize,
+            "max_size": self.max_size,
+            "resolutions": [
+                "%sx%s" % resolution for resolution in self.resolutions
+            ],
+        }
+
+    def save_options(self, quality):
+        """Get the options passed to Pillow to encode an image"""
+        options = {}
+        if self.format == "jpg":
+            options["quality"] = quality
+            options["progressive"] = self.progressive
+            options["optimize"] = self.optimize
+        elif self.format == "png":
+            options["optimize"] = self.optimize
+        elif self.format == "webp":
+            options["quality"] = quality
+            options["method"] = 6 if self.optimize else 4
+        return options
+
+    def outputs(self, file, name=None):
+        """Get the outputs of a wallpaper, relative to the output directory
+
+        The outputs are (path, resolution) tuples, with the resolution set
+        to None for the native size. The name of the native size output
+        defaults to the one returned by output_name()."""
+        if name is None:
+            name = output_name(file, self.format)
+        yield name, None
+
+        if file.endswith(".dds"):
+            for resolution in self.resolutions:
+                yield os.path.join("%sx%s" % resolution, name), resolution
+
+
+class Wallpaper:
+    """A distinct wallpaper to extract, with all the members containing it"""
+
+    def __init__(self, name, pack, file, content_hash):
+        self.name = name
+        self.pack = pack
+        self.file = file
+        self.hash = content_hash
+        self.duplicates = []
+
+
+def output_name(file, output_format="jpg"):
+    """Get the name of the output file of a wallpaper"""
+    if file.endswith(".dds"):
+        return file[:-4] + "." + output_format
+    return file
+
+
+def plan_reads(members):
+    """Plan the reads of some (pack, file) members, in archive order
+
+    Each member of the returned ranges is a ((pack, file), offset, size)
+    tuple."""
+    return ioplan.plan(
+        (pack.file.name, (pack, file)) + pack.entry(file)
+        for pack, file in members
+    )
+
+
+def select_files(packs, patterns=None):
+    """Get the files of a PackSet matching some glob patterns
+
+    The loading screens are selected if no patterns are provided. Files
+    whose names would be extracted outside of the output directory are
+    always skipped."""
+    if patterns is None:
+        return [
+            file for file in packs.glob(WALLPAPER_PATTERN)
+            if is_wallpaper(file) and fpk.is_safe_name(file)
+        ]
+
+    files = []
+    seen = set()
+    for pattern in patterns:
+        for file in packs.glob(pattern):
+            if file not in seen and fpk.is_safe_name(file):
+                seen.add(file)
+                files.append(file)
+    return files
+
+
+def plan_wallpapers(packs, sources, patterns=None,
+                    read_ahead=ioplan.READ_AHEAD, output_format="jpg"):
+    """Choose the wallpapers to extract from a PackSet
+
+    Every distinct content is extracted only once, even if it's contained
+    in multiple packs or under multiple names. If a name is used by
+    different contents, the one in the pack with the lowest priority gets
+    the plain name, while the other ones have their hash appended to it."""
+    files = select_files(packs, patterns)
+
+    # Hash the members not already known in archive order, so the packs
+    # are read sequentially and ahead of time
+    hashes = {
+        (pack, file): sources.cached_hash(pack, file)
+        for file in files for pack in packs.lookup_all(file)
+    }
+    ranges = plan_reads(
+        member for member, content_hash in hashes.items()
+        if content_hash is None
+    )
+    with ioplan.ReadAhead(ranges, read_ahead) as hints:
+        consumed = 0
+        for extent in ranges:
+            hints.advance(consumed)
+
+            # Each range is read at once, and its members sliced out of it
+            pack = extent.members[0][0][0]
+            with pack.view_range(extent.offset, extent.size) as data:
+                for member, offset, size in extent.members:
+                    start = offset - extent.offset
+                    hashes[member] = manifest.digest(
+                        data[start:start + size]
+                    )
+            consumed += extent.size
+
+    wallpapers = {}
+    names = {}
+    for file in files:
+        for pack in packs.lookup_all(file):
+            content_hash = hashes[pack, file]
+            if content_hash in wallpapers:
+                wallpapers[content_hash].duplicates.append((pack, file))
                 continue
 
-            # Extract the file from the pack
-            pack.extract(file, dest)
+            name = output_name(file, output_format)
+            if names.get(name, content_hash) != content_hash:
+                stem, ext = os.path.splitext(name)
+                name = "%s-%s%s" % (stem, content_hash[:8], ext)
+            names[name] = content_hash
 
-            # Convert the file from DDS to JPG and copy it
-            if file.endswith(".dds"):
-                jpg_file = file[:-4] + ".jpg"
+            wallpapers[content_hash] = Wallpaper(
+                name, pack, file, content_hash
+            )
 
-                # Convert the image with ImageMagick
-                subprocess.call([
-                    "convert",
-                    os.path.join(dest, file),
-                    os.path.join(dest, jpg_file)
-                ])
-                os.remove(os.path.join(dest, file))
+    return list(wallpapers.values())
+
+
+def convert_command(dest_file, resolution, settings):
+    """Get the ImageMagick command converting a DDS from stdin"""
+    command = ["convert", "dds:-"]
+    if resolution is not None:
+        # Scale the image to fill the resolution, and crop what's left
+        size = "%sx%s" % resolution
+        command += [
+            "-resize", size + "^", "-gravity", "center", "-extent", size,
+        ]
+
+    if settings.quality is not None:
+        command += ["-quality", str(settings.quality)]
+    if settings.format == "jpg":
+        if settings.progressive:
+            command += ["-interlace", "Plane"]
+        if settings.optimize:
+            command += ["-define", "jpeg:optimize-coding=true"]
+        if settings.max_size is not None:
+            command += ["-define", "jpeg:extent=%d" % settings.max_size]
+    elif settings.format == "png":
+        if settings.optimize:
+            command += ["-define", "png:compression-level=9"]
+    elif settings.format == "webp":
+        if settings.optimize:
+            command += ["-define", "webp:method=6"]
+        if settings.max_size is not None:
+            command += ["-define", "webp:target-size=%d" % settings.max_size]
+    return command + ["%s:%s" % (settings.format, dest_file)]
+
+
+def stream_command(dest_file, settings):
+    """Get the command encoding a PPM image from stdin to JPG, if any
+
+    The encoder must compress the image while it's being streamed, without
+    keeping all of it in memory: libjpeg's cjpeg does that. Size budgets
+    need multiple attempts, so they can't be streamed."""
+    if settings.format != "jpg" or settings.max_size is not None:
+        return
+    if shutil.which("cjpeg") is None:
+        return
+
+    command = ["cjpeg", "-quality", str(settings.quality)]
+    if settings.progressive:
+        command.append("-progressive")
+    if settings.optimize:
+        command.append("-optimize")
+    return command + ["-outfile", dest_file]
+
+
+def encoder_name(settings):
+    """Get the name of the encoder used for the native size wallpapers"""
+    if dds is None:
+        return "imagemagick"
+    if stream_command("", settings) is not None:
+        return "cjpeg"
+    return "pillow"
+
+
+def stream_texture(data, dest_file, settings, stats):
+    """Convert a DDS texture to JPG, a band of blocks at a time
+
+    The texture is decoded in bands, streamed to an external encoder as
+    they're ready: the memory used doesn't depend on the texture size.
+    Returns False if no encoder supporting that is available, or if it
+    failed."""
+    command = stream_command(temporary_path(dest_file), settings)
+    if command is None:
+        return False
+
+    with stats.stage("convert"):
+        header = dds.DdsHeader(data)
+        bands = dds.decode_bands(data)
+
+        process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        try:
+            process.stdin.write(b"P6\n%d %d\n255\n" % (
+                header.width, header.height,
+            ))
+            for band in bands:
+                process.stdin.write(band[..., :3].tobytes())
+        except BrokenPipeError:
+            pass  # The encoder died, its exit code tells what happened
+        except BaseException:
+            process.kill()
+            raise
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+            failed = process.wait() != 0
+
+    if failed:
+        try:
+            os.remove(temporary_path(dest_file))
+        except FileNotFoundError:
+            pass
+        return False
+    publish(dest_file)
+    record_written(dest_file, stats)
+    return True
+
+
+def encode_image(image, settings, quality):
+    """Encode an image with Pillow at a quality, returning a BytesIO"""
+    encoded = io.BytesIO()
+    image.save(
+        encoded, OUTPUT_FORMATS[settings.format][0],
+        **settings.save_options(quality)
+    )
+    return encoded
+
+
+def encode_within_budget(image, settings):
+    """Encode an image with the best quality fitting in the size budget
+
+    The quality is binary searched between the configured one and 1: if
+    not even the lowest one fits, the image is encoded with it anyway."""
+    encoded = encode_image(image, settings, settings.quality)
+    if (settings.max_size is None or settings.quality is None
+            or len(encoded.getbuffer()) <= settings.max_size):
+        return encoded
+
+    best = None
+    low, high = 1, settings.quality - 1
+    while low <= high:
+        quality = (low + high) // 2
+        encoded = encode_image(image, settings, quality)
+        if len(encoded.getbuffer()) <= settings.max_size:
+            best = encoded
+            low = quality + 1
+        else:
+            high = quality - 1
+
+    # The last attempt was with the lowest quality if nothing fit
+    return best if best is not None else encoded
+
+
+def resize_cover(image, resolution):
+    """Scale an image to fill a resolution, cropping what's left"""
+    width, height = resolution
+    scale = max(width / image.width, height / image.height)
+    size = (
+        max(width, round(image.width * scale)),
+        max(height, round(image.height * scale)),
+    )
+    if size != image.size:
+        image = image.resize(size, PIL.Image.LANCZOS)
+
+    left = (size[0] - width) // 2
+    top = (size[1] - height) // 2
+    return image.crop((left, top, left + width, top + height))
+
+
+def decode_texture(data, dest, outputs, settings, stats):
+    """Convert a DDS texture in-process, if its format is supported"""
+    if dds is None:
+        return False
+
+    try:
+        with stats.stage("convert"):
+            header = dds.DdsHeader(data)
+            dds.block_array(data, header)
+    except dds.DdsError:
+        return False
+
+    pending = []
+    for path, resolution in outputs:
+        # The native size can be encoded without decoding all of it at once
+        if resolution is None and stream_texture(
+            data, output_path(dest, path), settings, stats
+        ):
+            continue
+
+        # Start from the smallest mipmap level big enough for the output
+        level = 0
+        if resolution is not None:
+            level = header.best_level(*resolution)
+        pending.append((level, path, resolution))
+
+    # Every level is decoded only once, and dropped as soon as all the
+    # outputs made from it are encoded
+    pending.sort(key=lambda output: output[0])
+    decoded = None
+    for level, path, resolution in pending:
+        with stats.stage("convert"):
+            if level != decoded:
+                image = None  # Not kept while decoding the next level
+                image = PIL.Image.fromarray(dds.decode(data, level)[..., :3])
+                decoded = level
+
+            if resolution is None:
+                encoded = encode_within_budget(image, settings)
+            else:
+                encoded = encode_within_budget(
+                    resize_cover(image, resolution), settings
+                )
+
+        with stats.stage("write"):
+            dest_file = output_path(dest, path)
+            with open(temporary_path(dest_file), "wb") as out:
+                out.write(encoded.getbuffer())
+            publish(dest_file)
+        stats.written(len(encoded.getbuffer()))
+
+    return True
 
-            break
+
+def convert_texture(data, dest, outputs, settings, stats):
+    """Convert a DDS texture to the output format"""
+    outputs = list(outputs)
+    if decode_texture(data, dest, outputs, settings, stats):
+        return
+
+    # Stream the texture to ImageMagick, without temporary files
+    for path, resolution in outputs:
+        dest_file = output_path(dest, path)
+        with stats.stage("convert"):
+            subprocess.run(convert_command(
+                temporary_path(dest_file), resolution, settings
+            ), input=data)
+        publish(dest_file)
+        record_written(dest_file, stats)
+
+
+async def convert_texture_async(data, dest, outputs, settings, stats):
+    """Convert a DDS texture with ImageMagick, asynchronously"""
+    for path, resolution in outputs:
+        dest_file = output_path(dest, path)
+        with stats.stage("convert"):
+            process = await asyncio.create_subprocess_exec(
+                *convert_command(
+                    temporary_path(dest_file), resolution, settings
+                ),
+                stdin=asyncio.subprocess.PIPE
+            )
+            await process.communicate(data)
+        publish(dest_file)
+        record_written(dest_file, stats)
+
+
+def output_path(dest, path):
+    """Get the full path of an output, refusing the ones outside ``dest``"""
+    if not fpk.is_safe_name(path):
+        raise fpk.FpkError("Unsafe file name: %s" % path)
+    return os.path.join(dest, path)
+
+
+def temporary_path(path):
+    """Get the path an output is written to before being moved in place"""
+    return path + ".tmp"
+
+
+def publish(path):
+    """Move an output in place, if it was written to its temporary path
+
+    Renaming it makes the output appear complete all at once, to the users
+    of the system-wide store too."""
+    try:
+        os.replace(temporary_path(path), path)
+    except FileNotFoundError:
+        pass
+
+
+def record_written(path, stats):
+    """Record the size of a file written by an external process"""
+    try:
+        stats.written(os.path.getsize(path))
+    except OSError:
+        pass
+
+
+def is_extracted(existing, wallpaper, dest, settings):
+    """Check if an up to date wallpaper was already extracted"""
+    for path, _ in settings.outputs(wallpaper.file, wallpaper.name):
+        if not os.path.exists(os.path.join(dest, path)):
+            return False
+
+    return manifest.is_up_to_date(
+        existing, wallpaper.hash, settings.manifest()
+    )
+
+
+def extract_wallpaper(pack, file, dest, settings, stats=None, name=None):
+    """Extract a single wallpaper from an open pack
+
+    The wallpaper is stored as ``name``, by default the one returned by
+    output_name()."""
+    if stats is None:
+        stats = Stats()
+    start = time.perf_counter()
+
+    # Files which don't need to be converted are copied by the kernel
+    if not file.endswith(".dds"):
+        _, size = pack.entry(file)
+        if name is None:
+            name = output_name(file)
+        with stats.stage("write"):
+            pack.extract(file, dest, output=temporary_path(name))
+            publish(os.path.join(dest, name))
+        stats.written(size)
+        stats.member(pack.file.name, size, time.perf_counter() - start)
+        return
+
+    with stats.stage("read"):
+        data = pack.view(file)
+
+    with data:
+        # Convert the file from DDS to the output format
+        outputs = settings.outputs(file, name)
+        convert_texture(data, dest, outputs, settings, stats)
+        size = len(data)
+    stats.member(pack.file.name, size, time.perf_counter() - start)
+
+
+def extract_pack(path, dest, stats=None):
+    """Extract wallpapers from a single .fpk file"""
+    if stats is None:
+        stats = Stats()
+
+    with stats.stage("parse"):
+        pack = fpk.open(path, cache_dir=os.path.join(dest, CACHE_DIR))
+    pack.advise_sequential()
+
+    ranges = plan_reads((pack, file) for file in wallpaper_names(pack))
+    with ioplan.ReadAhead(ranges) as hints:
+        consumed = 0
+        for extent in ranges:
+            hints.advance(consumed)
+            for (_, file), _, _ in extent.members:
+                extract_wallpaper(
+                    pack, file, dest, ConversionSettings(), stats
+                )
+            consumed += extent.size
 
     pack.close()
 
 
-def extract_wallpapers(resources_dir, dest):
-    """Extract wallpapers from the resources directory"""
-    count = 0
+# Packs opened by the current worker process, reused across tasks
+_worker_packs = {}
+
+
+def _extract_batch_worker(path, members, dest, settings):
+    """Extract a batch of wallpapers from a pack, from a worker process
+
+    The members are (file, name) tuples. The statistics collected by the
+    worker are returned, to be merged by the main process."""
+    stats = Stats()
+    if path not in _worker_packs:
+        with stats.stage("parse"):
+            _worker_packs[path] = fpk.open(
+                path, use_mmap=True, cache_dir=os.path.join(dest, CACHE_DIR)
+            )
+            _worker_packs[path].advise_sequential()
+
+    for file, name in members:
+        extract_wallpaper(
+            _worker_packs[path], file, dest, settings, stats, name
+        )
+    return stats
+
+
+def member_size(wallpaper):
+    """Get the size of the member a wallpaper is extracted from"""
+    return wallpaper.pack.entry(wallpaper.file)[1]
+
+
+def batch_wallpapers(wallpapers, size):
+    """Split wallpapers into batches of consecutive ones from the same pack"""
+    batches = []
+    for wallpaper in wallpapers:
+        if (batches and len(batches[-1]) < size
+                and batches[-1][0].pack is wallpaper.pack):
+            batches[-1].append(wallpaper)
+        else:
+            batches.append([wallpaper])
+    return batches
+
+
+async def _extract_wallpapers_async(wallpapers, dest, settings, stats, jobs,
+                                    progress, hints):
+    """Extract some wallpapers, running at most jobs at a time
+
+    Textures are decoded by a pool of worker processes if the in-process
+    decoder is available, otherwise they're streamed straight from the
+    archives into concurrent ImageMagick processes. The packs are read
+    ahead of the workers according to ``hints``."""
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(jobs)
+
+    executor = None
+    batch_size = 1
+    if dds is not None:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+
+        # Batches must be small enough to keep all the workers busy, but
+        # big ones amortize the cost of each task with many wallpapers
+        batch_size = max(1, min(BATCH_SIZE, len(wallpapers) // (jobs * 4)))
+
+    async def process(batch):
+        pack = batch[0].pack
+        async with limit:
+            if executor is None and not batch[0].file.endswith(".dds"):
+                # Copied by the kernel from the packs opened here, without
+                # opening them again in this process
+                for wallpaper in batch:
+                    extract_wallpaper(
+                        pack, wallpaper.file, dest, settings, stats,
+                        wallpaper.name,
+                    )
+            elif executor is not None:
+                stats.merge(await loop.run_in_executor(
+                    executor, _extract_batch_worker, pack.file.name,
+                    [(wallpaper.file, wallpaper.name) for wallpaper in batch],
+                    dest, settings,
+                ))
+            else:
+                wallpaper = batch[0]
+                start = time.perf_counter()
+                with stats.stage("read"):
+                    data = pack.view(wallpaper.file)
+                with data:
+                    outputs = settings.outputs(wallpaper.file, wallpaper.name)
+                    await convert_texture_async(
+                        data, dest, outputs, settings, stats
+                    )
+                    size = len(data)
+
+                elapsed = time.perf_counter() - start
+                stats.member(pack.file.name, size, elapsed)
+
+        hints.consume((wallpaper.pack, wallpaper.file) for wallpaper in batch)
+        if progress is not None:
+            progress.update(len(batch), sum(map(member_size, batch)))
+
+    if not wallpapers:
+        return
+
+    pending = [
+        asyncio.ensure_future(process(batch))
+        for batch in batch_wallpapers(wallpapers, batch_size)
+    ]
+    try:
+        done, pending = await asyncio.wait(
+            pending, return_when=asyncio.FIRST_EXCEPTION
+        )
+        for task in done:
+            task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def extract_wallpapers(resources_dirs, dest, jobs=None, resolutions=(),
+                       stats=None, patterns=None,
+                       progress=None, read_ahead=ioplan.READ_AHEAD,
+                       settings=None):
+    """Extract wallpapers from one or more resources directories
+
+    Up to ``jobs`` wallpapers (by default one for each CPU) are extracted
+    and converted at the same time. Wallpapers already extracted by a
+    previous run are skipped if they didn't change since then, and every
+    distinct wallpaper is extracted only once. Additional copies of the
+    wallpapers, scaled to each of the (width, height) ``resolutions``, are
+    stored in subdirectories named after them. The format and the quality
+    of the images can be changed by providing a ConversionSettings instance
+    as ``settings``, which overrides ``resolutions``.
+
+    Every member matching one of the glob ``patterns`` (by default the
+    loading screens) is extracted, in the order it's stored in the packs,
+    asking the kernel to read up to ``read_ahead`` bytes ahead of time.
+    Members which aren't textures are copied as they are.
+
+    Timing and throughput statistics are collected in ``stats``, if a
+    Stats instance is provided, and the progress is reported to
+    ``progress``, if a Progress instance is provided. Returns False,
+    without touching ``dest``, if there are no packs to extract from."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if stats is None:
+        stats = Stats()
+    if settings is None:
+        settings = ConversionSettings(resolutions)
+
+    with stats.total(), lock_output(dest):
+        return _extract_wallpapers(resources_dirs, dest, jobs, settings,
+                                   stats, patterns, progress, read_ahead)
+
+
+@contextlib.contextmanager
+def lock_output(dest):
+    """Hold the lock of an output directory, waiting for other extractions"""
+    path = os.path.join(dest, LOCK_FILE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        yield
+
+
+def remove_renamed(dest, outputs, entries):
+    """Remove the wallpapers now extracted under a different name
+
+    That happens when the output format changes: the files extracted with
+    the old one would otherwise be shown alongside the new ones."""
+    current = set(entry["hash"] for entry in entries.values())
+    for name, existing in list(outputs.items()):
+        if name in entries or not isinstance(existing, dict):
+            continue
+        if existing.get("hash") not in current:
+            continue
+
+        for path in existing.get("outputs", {}):
+            if not fpk.is_safe_name(path):
+                continue
+            try:
+                os.remove(os.path.join(dest, path))
+            except FileNotFoundError:
+                pass
+        del outputs[name]
+
+
+def _extract_wallpapers(resources_dirs, dest, jobs, settings, stats,
+                        patterns, progress, read_ahead):
+    """Implementation of extract_wallpapers()"""
+    os.makedirs(dest, exist_ok=True)
+
+    outputs = manifest.load(dest)
+
+    # Small batches of wallpapers are scheduled instead of whole packs, so
+    # the work is spread evenly between the workers
+    paths = list(find_packs(resources_dirs))
+    if not paths:
+        return False
+    with stats.stage("parse"):
+        packs = packset.open(
+            paths, use_mmap=True, cache_dir=os.path.join(dest, CACHE_DIR)
+        )
+    try:
+        # The wallpapers extracted by the user replace the shared ones, but
+        # only once there's something to extract
+        store.remove_view(dest)
+
+        # The members are hashed and extracted in the order they're stored
+        for pack in packs.packs:
+            pack.advise_sequential()
+
+        with stats.stage("read"):
+            wallpapers = plan_wallpapers(
+                packs, manifest.Sources(outputs), patterns, read_ahead,
+                settings.format,
+            )
+
+        entries = {}
+        pending = []
+        directories = set()
+        for wallpaper in wallpapers:
+            entries[wallpaper.name] = manifest.entry(
+                wallpaper.pack, wallpaper.file, wallpaper.hash,
+                settings.manifest(), wallpaper.duplicates,
+            )
+            if not is_extracted(
+                outputs.get(wallpaper.name), wallpaper, dest, settings
+            ):
+                pending.append(wallpaper)
+                for path, _ in settings.outputs(
+                    wallpaper.file, wallpaper.name
+                ):
+                    directories.add(os.path.dirname(path))
+
+        for directory in directories:
+            os.makedirs(os.path.join(dest, directory), exist_ok=True)
+
+        # Read the members in the order they're stored in the packs
+        by_member = {
+            (wallpaper.pack, wallpaper.file): wallpaper
+            for wallpaper in pending
+        }
+        ranges = plan_reads(by_member.keys())
+        pending = [
+            by_member[member]
+            for extent in ranges for member, _, _ in extent.members
+        ]
+        if progress is not None:
+            progress.start(len(pending), sum(map(member_size, pending)))
+
+        with ioplan.ReadAhead(ranges, read_ahead) as hints:
+            if jobs == 1:
+                for wallpaper in pending:
+                    extract_wallpaper(
+                        wallpaper.pack, wallpaper.file, dest, settings,
+                        stats, wallpaper.name,
+                    )
+                    hints.consume([(wallpaper.pack, wallpaper.file)])
+                    if progress is not None:
+                        progress.update(1, member_size(wallpaper))
+            else:
+                asyncio.run(_extract_wallpapers_async(
+                    pending, dest, settings, stats, jobs, progress, hints
+                ))
+
+        if progress is not None:
+            progress.finish()
+
+        # Record the hashes of the outputs, to detect corrupted files later
+        extracted = set(wallpaper.name for wallpaper in pending)
+        for wallpaper in wallpapers:
+            existing = outputs.get(wallpaper.name)
+            recorded = None
+            if wallpaper.name not in extracted and isinstance(existing, dict):
+                recorded = existing.get("outputs")
+            if recorded is None:
+                recorded = manifest.output_hashes(dest, [
+                    path for path, _ in
+                    settings.outputs(wallpaper.file, wallpaper.name)
+                ])
+            entries[wallpaper.name]["outputs"] = recorded
+    finally:
+        packs.close()
+
+    remove_renamed(dest, outputs, entries)
+    outputs.update(entries)
+    manifest.save(dest, outputs)
 
-    for pack in find_packs(resources_dir):
-        extract_pack(pack, dest)
-        count += 1
+    # Keep the slideshow in sync with the wallpapers, if it's used
+    slideshow.refresh(dest)
 
-    return count > 0
+    return True
@@ -17,7 +17,13 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import builtins
+import hashlib
+import errno
 import struct
+import array
+import json
+import mmap
+import io
 import os
 
 
@@ -28,55 +34,221 @@ class FpkError(Exception):
     pass
 
 
+def is_safe_name(name):
+    """Check if a name can be joined to a directory without escaping it"""
+    if not name or name.startswith("/") or "\0" in name:
+        return False
+    return ".." not in name.split("/")
+
+
+def read_index(file):
+    """Read the whole index region of an archive with a single bulk read
+
+    Only the first item is decoded here, to learn where the index ends (its
+    data starts right after the aligned end of the index)."""
+    file.seek(0)
+    size = os.fstat(file.fileno()).st_size
+
+    try:
+        buf = file.read(10 + 4 + 4)
+        if buf[:10] != EXPECTED_MAGIC:
+            raise FpkError("Wrong magic string: %s" % buf[:10])
+
+        name_len = struct.unpack_from("<I", buf, 10 + 4)[0]
+        buf += file.read(name_len + 4)
+        extra_bytes = struct.unpack_from("<I", buf, len(buf) - 4)[0] + 4
+        buf += file.read(extra_bytes + 4 + 4)
+        first_offset = struct.unpack_from("<I", buf, len(buf) - 4)[0]
+    except struct.error:
+        raise FpkError("Truncated archive index")
+
+    if first_offset > size:
+        raise FpkError("Index goes past the end of the archive")
+
+    if first_offset > len(buf):
+        buf += file.read(first_offset - len(buf))
+    return buf
+
+
+# Errors meaning a zero-copy method isn't supported for a pair of files
+UNSUPPORTED_COPY_ERRNOS = {
+    errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF,
+}
+
+
+def _copy_file_range(src, dst, offset, count):
+    return os.copy_file_range(src, dst, count, offset)
+
+
+def _sendfile(src, dst, offset, count):
+    return os.sendfile(dst, src, offset, count)
+
+
+def copy_range(src, offset, size, dst, buffer=1024 * 64):
+    """Copy a range of a file at the current position of another one
+
+    The data is copied by the kernel with copy_file_range() or sendfile()
+    when possible, falling back to reading and writing ``buffer`` bytes at
+    a time otherwise."""
+    src_fd = src.fileno()
+    dst_fd = dst.fileno()
+    dst.flush()
+
+    copied = 0
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(_copy_file_range)
+    if hasattr(os, "sendfile"):
+        methods.append(_sendfile)
+
+    for method in methods:
+        try:
+            while copied < size:
+                count = method(src_fd, dst_fd, offset + copied, size - copied)
+                if not count:
+                    raise FpkError("Unexpected end of the archive")
+                copied += count
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_COPY_ERRNOS:
+                raise
+
+    src.seek(offset + copied)
+    while copied < size:
+        data = src.read(min(buffer, size - copied))
+        if not data:
+            raise FpkError("Unexpected end of the archive")
+
+        view = memoryview(data)
+        while view:
+            view = view[os.write(dst_fd, view):]
+        copied += len(data)
+
+
+class FpkMember(io.RawIOBase):
+    """Read-only file-like object bounded to a single archive member"""
+
+    def __init__(self, view):
+        self.view = view
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.view[self.pos:self.pos + len(buffer)]
+        buffer[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self.view) + offset
+        else:
+            raise ValueError("Invalid whence: %s" % whence)
+
+        if pos < 0:
+            raise ValueError("Negative seek position: %s" % pos)
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        """Release the underlying view"""
+        if not self.closed:
+            self.view.release()
+        super().close()
+
+
 class FpkArchive:
     """This class represents a .fpk archive"""
 
-    def __init__(self, file):
+    def __init__(self, file, use_mmap=False, toc=None):
         self.file = file
 
-        # Seek to the start of the file
-        file.seek(0)
+        # Map the whole archive in memory if requested: the header is then
+        # parsed from the mapping, and members are served as views into it
+        self.mmap = None
+        if use_mmap:
+            try:
+                self.mmap = mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+            except ValueError:
+                # Empty files can't be mapped
+                raise FpkError("Empty archive file")
+            file = self.mmap
+
+        # A table of contents already parsed and validated before (for
+        # example loaded from the cache) skips reading the header at all
+        if toc is not None:
+            self.load_toc(toc)
+            return
 
-        # Load the file header
-        magic, item_count = struct.unpack("<10s I", file.read(10 + 4))
+        if self.mmap is not None:
+            index = self.mmap
+        else:
+            index = read_index(file)
+
+        try:
+            self.parse_index(index)
+        except struct.error:
+            raise FpkError("Truncated archive index")
+
+    def parse_index(self, buf):
+        """Parse the archive index from a buffer containing it"""
+        magic, item_count = struct.unpack_from("<10s I", buf, 0)
         if magic != EXPECTED_MAGIC:
             raise FpkError("Wrong magic string: %s" % magic)
 
         if not item_count:
             raise FpkError("Empty archive!")
 
-        self.items = {}
-        first_item_name = None
-        last_item_name = None
+        self.names = []
+        self.offsets = array.array("I")
+        self.sizes = array.array("I")
+        self.index = {}
+
+        pos = 10 + 4
         for i in range(item_count):
             # Read the length of the name
-            name_len = struct.unpack("<I", file.read(4))[0]
+            name_len = struct.unpack_from("<I", buf, pos)[0]
             if not name_len:
                 raise FpkError("Empty file name (index %s)" % i)
+            pos += 4
 
             # Read the name
-            name = file.read(name_len).decode("utf-8")
-            if first_item_name is None:
-                first_item_name = name
+            name = bytes(buf[pos:pos + name_len]).decode("utf-8")
+            pos += name_len
 
             # Check if the first bytes are 0es
-            extra_bytes = struct.unpack("<I", file.read(4))[0] + 4
-            if file.read(extra_bytes) != b"\x00" * extra_bytes:
+            extra_bytes = struct.unpack_from("<I", buf, pos)[0] + 4
+            pos += 4
+            if buf[pos:pos + extra_bytes] != b"\x00" * extra_bytes:
                 raise FpkError("File start 0es of item %s are not present" % i)
+            pos += extra_bytes
 
             # Get the file size and offset
-            file_size, file_offset = struct.unpack("<II", file.read(4 + 4))
+            file_size, file_offset = struct.unpack_from("<II", buf, pos)
+            pos += 4 + 4
             if not file_size:
                 raise FpkError("Empty file size for item %s" % i)
             if not file_offset:
                 raise FpkError("Empty file offset for item %s" % i)
 
             # Sanity check for the offset
-            if last_item_name is not None:
-                last_item = self.items[last_item_name]
-
+            if i:
                 # Get the hypotetic offset
-                hypotetic_offset = last_item["offset"] + last_item["size"]
+                hypotetic_offset = self.offsets[-1] + self.sizes[-1]
                 if hypotetic_offset % 4 != 0:
                     hypotetic_offset += 4 - hypotetic_offset % 4  # Alignment
 
@@ -87,59 +259,179 @@ class FpkArchive:
                     ))
 
             # Store the item
-            self.items[name] = {
-                "name": name,
-                "size": file_size,
-                "offset": file_offset,
-            }
-            last_item_name = name
-
-        # Get and align the current position
-        current_pos = file.tell()
-        if current_pos % 4 != 0:
-            current_pos += 4 - current_pos % 4
+            self.index[name] = len(self.names)
+            self.names.append(name)
+            self.offsets.append(file_offset)
+            self.sizes.append(file_size)
+
+        # Align the current position
+        if pos % 4 != 0:
+            pos += 4 - pos % 4
 
         # Check if the current position is right
-        expected_pos = self.items[first_item_name]["offset"]
-        if expected_pos != current_pos:
+        expected_pos = self.offsets[0]
+        if expected_pos != pos:
             raise FpkError(
-                "Wrong offset for item 1: %s instead of %s",
-                current_pos, expected_pos
+                "Wrong offset for item 1: %s instead of %s"
+                % (pos, expected_pos)
             )
 
+    def toc(self):
+        """Get the table of contents, in a JSON-serializable format"""
+        return {
+            "names": self.names,
+            "offsets": self.offsets.tolist(),
+            "sizes": self.sizes.tolist(),
+        }
+
+    def load_toc(self, toc):
+        """Load a table of contents returned by the toc() method"""
+        self.names = list(toc["names"])
+        self.offsets = array.array("I", toc["offsets"])
+        self.sizes = array.array("I", toc["sizes"])
+        if not len(self.names) == len(self.offsets) == len(self.sizes):
+            raise FpkError("Inconsistent table of contents")
+
+        self.index = {name: i for i, name in enumerate(self.names)}
+
+    def entry(self, name):
+        """Get the (offset, size) of a file in the archive"""
+        if name not in self.index:
+            raise NameError("File not in the archive: %s" % name)
+
+        i = self.index[name]
+        return self.offsets[i], self.sizes[i]
+
     def files(self):
         """Get a list of all the files"""
-        return list(self.items.keys())
+        return list(self.index.keys())
 
-    def extract(self, name, dest, buffer=1024 * 16):
-        """Extract a file from the archive"""
-        if name not in self.items:
-            raise NameError("File not in the archive: %s" % name)
+    def view(self, name):
+        """Get the content of a file as a memoryview
+
+        If the archive is memory-mapped the view points directly into the
+        mapping, without copying any data."""
+        return self.view_range(*self.entry(name))
+
+    def view_range(self, offset, size):
+        """Get a range of the archive as a memoryview, read all at once"""
+        if self.mmap is not None:
+            return memoryview(self.mmap)[offset:offset + size]
+
+        self.file.seek(offset)
+        return memoryview(self.file.read(size))
+
+    def member(self, name):
+        """Get a read-only file-like object for a file in the archive"""
+        return FpkMember(self.view(name))
+
+    def extract(self, name, dest, buffer=1024 * 64, output=None):
+        """Extract a file from the archive
+
+        The file is stored in ``dest`` as ``output``, by default the name
+        of the file in the archive."""
+        offset, size = self.entry(name)
+        if not is_safe_name(output or name):
+            raise FpkError("Unsafe file name: %s" % (output or name))
 
         if not os.path.exists(dest):
             os.makedirs(dest)
 
-        item = self.items[name]
-        with builtins.open(os.path.join(dest, item["name"]), "wb") as out:
-            # Go to the right archive spot
-            self.file.seek(item["offset"])
+        path = os.path.join(dest, output or name)
+        with builtins.open(path, "wb") as out:
+            copy_range(self.file, offset, size, out, buffer)
+
+    def advise_sequential(self):
+        """Tell the kernel the members are going to be read in order
 
-            # Copy the data to the new file
-            pos = 0
-            while pos < item["size"]:
-                data = self.file.read(max(pos + buffer, item["size"] - pos))
-                out.write(data)
-                pos += len(data)
+        Both the mapping (if any) and the file are advised, since the
+        kernel tracks the read-ahead of each of them separately."""
+        if self.mmap is not None and hasattr(mmap, "MADV_SEQUENTIAL"):
+            self.mmap.madvise(mmap.MADV_SEQUENTIAL)
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(
+                self.file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL
+            )
 
     def close(self):
         """Close the file"""
+        if self.mmap is not None:
+            try:
+                self.mmap.close()
+            except BufferError:
+                # Some views are still alive: the mapping will be released
+                # as soon as they're garbage collected
+                pass
+            self.mmap = None
+
         self.file.close()
 
 
-def open(name):
-    """Open an existing .fpk archive"""
+def toc_cache_key(file):
+    """Get the key identifying the current version of an archive"""
+    stat = os.fstat(file.fileno())
+    return {
+        "path": os.path.abspath(file.name),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+        "inode": stat.st_ino,
+    }
+
+
+def toc_cache_path(cache_dir, name):
+    """Get the path of the cached table of contents of an archive"""
+    digest = hashlib.sha1(os.path.abspath(name).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, "toc-%s.json" % digest)
+
+
+def load_cached_toc(cache_dir, file):
+    """Load the cached table of contents of an archive, if still valid"""
+    try:
+        with builtins.open(toc_cache_path(cache_dir, file.name)) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    if cached.get("key") != toc_cache_key(file):
+        return
+    return cached.get("toc")
+
+
+def save_cached_toc(cache_dir, archive):
+    """Store the table of contents of an archive in the cache"""
+    os.makedirs(cache_dir, exist_ok=True)
+
+    path = toc_cache_path(cache_dir, archive.file.name)
+    with builtins.open(path + ".tmp", "w") as f:
+        json.dump({
+            "key": toc_cache_key(archive.file),
+            "toc": archive.toc(),
+        }, f)
+    os.replace(path + ".tmp", path)
+
+
+def open(name, use_mmap=False, cache_dir=None):
+    """Open an existing .fpk archive
+
+    If a cache directory is provided, the table of contents is loaded from
+    there as long as the archive didn't change since it was cached."""
     if not os.path.exists(name):
         raise ValueError("File %s not found" % name)
 
     file = builtins.open(name, "rb")
-    return FpkArchive(file)
+    if cache_dir is None:
+        return FpkArchive(file, use_mmap)
+
+    toc = load_cached_toc(cache_dir, file)
+    if toc is not None:
+        try:
+            return FpkArchive(file, use_mmap, toc)
+        except (FpkError, KeyError, TypeError):
+            pass  # Corrupted cache, parse the archive again
+
+    archive = FpkArchive(file, use_mmap)
+    try:
+        save_cached_toc(cache_dir, archive)
+    except OSError:
+        pass  # The archive was parsed anyway, it's just slower next time
+    return archive
@@ -0,0 +1,145 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+
+
+# How many bytes the kernel is asked to read ahead of the reader
+READ_AHEAD = 1024 * 1024 * 64
+
+# Members separated by less than this are read as a single range
+MAX_GAP = 1024 * 64
+
+# Ranges are never coalesced past this size
+MAX_RANGE = 1024 * 1024 * 16
+
+
+class Range:
+    """A contiguous range of a pack, covering one or more members"""
+
+    def __init__(self, path, offset):
+        self.path = path
+        self.offset = offset
+        self.end = offset
+        self.members = []
+
+    @property
+    def size(self):
+        return self.end - self.offset
+
+
+def plan(members, max_gap=MAX_GAP, max_size=MAX_RANGE):
+    """Sort some members by (pack, offset) and coalesce them into ranges
+
+    The members are (path, name, offset, size) tuples. Members closer than
+    ``max_gap`` bytes are put in the same range, as long as it doesn't grow
+    past ``max_size`` bytes."""
+    ranges = []
+    for path, name, offset, size in sorted(
+        members, key=lambda member: (member[0], member[2])
+    ):
+        last = ranges[-1] if ranges else None
+        if (last is None or last.path != path
+                or offset - last.end > max_gap
+                or offset + size - last.offset > max_size):
+            last = Range(path, offset)
+            ranges.append(last)
+
+        last.members.append((name, offset, size))
+        last.end = max(last.end, offset + size)
+
+    return ranges
+
+
+class ReadAhead:
+    """Ask the kernel to read some ranges before they're needed
+
+    The ranges up to ``window`` bytes past the ones already consumed are
+    prefetched into the page cache, which is shared by every reader of the
+    packs. The reader reports how many bytes of the ranges it consumed with
+    advance(), or which members it consumed with consume().
+
+    Sequential access must be advised by the readers themselves (see
+    FpkArchive.advise_sequential()): that hint only applies to the file or
+    the mapping it's given to."""
+
+    def __init__(self, ranges, window=READ_AHEAD):
+        self.ranges = ranges
+        self.window = window
+        self.fds = {}
+        self.hinted = 0
+
+        # Bytes of all the ranges before each one
+        self.starts = [0]
+        for extent in ranges:
+            self.starts.append(self.starts[-1] + extent.size)
+
+        # Bytes of the ranges each member accounts for, including the gap
+        # before it, so the members can be consumed in any order
+        self.spans = {}
+        for extent in ranges:
+            position = extent.offset
+            for name, offset, size in extent.members:
+                end = max(position, offset + size)
+                self.spans[name] = end - position
+                position = end
+        self.consumed = 0
+
+        self.enabled = hasattr(os, "posix_fadvise")
+        if self.enabled:
+            for extent in ranges:
+                if extent.path not in self.fds:
+                    self.fds[extent.path] = self.open(extent.path)
+
+    def open(self, path):
+        """Open a pack, only to give the hints"""
+        return os.open(path, os.O_RDONLY)
+
+    def advance(self, consumed):
+        """Prefetch the ranges in the window after ``consumed`` bytes"""
+        if not self.enabled:
+            return
+
+        limit = consumed + self.window
+        while self.hinted < len(self.ranges):
+            if self.starts[self.hinted] >= limit:
+                break
+
+            extent = self.ranges[self.hinted]
+            os.posix_fadvise(
+                self.fds[extent.path], extent.offset, extent.size,
+                os.POSIX_FADV_WILLNEED,
+            )
+            self.hinted += 1
+
+    def consume(self, names):
+        """Prefetch the ranges in the window after some more members"""
+        for name in names:
+            self.consumed += self.spans[name]
+        self.advance(self.consumed)
+
+    def close(self):
+        """Close the packs opened to give the hints"""
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+        self.enabled = False
+
+    def __enter__(self):
+        self.advance(0)
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,139 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import os
+
+from . import fpk
+
+
+# The manifest records where every wallpaper in the output directory comes
+# from, so unchanged wallpapers can be skipped by later extractions
+MANIFEST_FILE = ".manifest.json"
+
+
+def load(directory):
+    """Load the manifest of an output directory"""
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(manifest, dict):
+        return {}
+    return manifest
+
+
+def save(directory, manifest):
+    """Save the manifest of an output directory"""
+    path = os.path.join(directory, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def digest(data):
+    """Get the content hash of some data"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path):
+    """Get the content hash of a file, or None if it doesn't exist"""
+    try:
+        with open(path, "rb") as f:
+            return digest(f.read())
+    except FileNotFoundError:
+        return
+
+
+def output_hashes(directory, paths):
+    """Get the content hashes of some outputs, relative to the directory"""
+    hashes = {}
+    for path in paths:
+        content_hash = file_digest(os.path.join(directory, path))
+        if content_hash is not None:
+            hashes[path] = content_hash
+    return hashes
+
+
+def source(pack, file):
+    """Describe where a member of a pack is located"""
+    offset, size = pack.entry(file)
+    return {
+        "pack": os.path.abspath(pack.file.name),
+        "pack_key": fpk.toc_cache_key(pack.file),
+        "member": file,
+        "offset": offset,
+        "size": size,
+    }
+
+
+def entry(pack, file, content_hash, settings, duplicates=()):
+    """Create the manifest entry of a wallpaper extracted from a pack
+
+    Other members with the same content, which weren't extracted again,
+    can be recorded as (pack, file) ``duplicates``."""
+    result = source(pack, file)
+    result["hash"] = content_hash
+    result["settings"] = settings
+    result["duplicates"] = [source(*duplicate) for duplicate in duplicates]
+    return result
+
+
+class Sources:
+    """Index of the members recorded in a manifest, with their hashes"""
+
+    def __init__(self, manifest):
+        self.sources = {}
+        for existing in manifest.values():
+            if not isinstance(existing, dict):
+                continue
+
+            for recorded in [existing] + existing.get("duplicates", []):
+                key = (recorded.get("pack"), recorded.get("member"))
+                self.sources[key] = recorded, existing.get("hash")
+
+    def cached_hash(self, pack, file):
+        """Get the recorded hash of a member, if its pack didn't change"""
+        key = (os.path.abspath(pack.file.name), file)
+        if key not in self.sources:
+            return
+        recorded, content_hash = self.sources[key]
+
+        # The pack key changes as soon as the pack is modified
+        current = source(pack, file)
+        if any(recorded.get(field) != value
+               for field, value in current.items()):
+            return
+        return content_hash
+
+    def hash(self, pack, file):
+        """Get the hash of a member, reading it only if needed"""
+        content_hash = self.cached_hash(pack, file)
+        if content_hash is None:
+            with pack.view(file) as data:
+                content_hash = digest(data)
+        return content_hash
+
+
+def is_up_to_date(existing, content_hash, settings):
+    """Check if a manifest entry matches some content and settings"""
+    if existing is None:
+        return False
+
+    return (existing.get("hash") == content_hash
+            and existing.get("settings") == settings)
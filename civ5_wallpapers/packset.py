@@ -0,0 +1,129 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import bisect
+import fnmatch
+import os
+import re
+
+from . import fpk
+
+
+BASE_PACK = "uitextures.fpk"
+
+GLOB_SPECIAL_RE = re.compile(r"[*?\[]")
+
+
+def pack_priority(path):
+    """Get the sort key of a pack: later packs override earlier ones
+
+    The base game comes first, then the DLCs and finally the expansions.
+    Packs inside a "dlc" directory are never considered part of the base
+    game, even if they're named like it."""
+    name = os.path.basename(path).lower()
+    parents = os.path.dirname(os.path.abspath(path)).lower().split(os.sep)
+    dlc = parents[parents.index("dlc") + 1:] if "dlc" in parents else None
+
+    if name == BASE_PACK and dlc is None:
+        category = 0
+    elif "expansion" in name or "expansion" in "/".join(dlc or []):
+        category = 2
+    else:
+        category = 1
+    return category, name, path
+
+
+class PackSet:
+    """This class represents multiple packs merged together
+
+    Every file name is resolved to the pack with the highest priority
+    containing it, as the game itself does."""
+
+    def __init__(self, packs):
+        self.packs = sorted(
+            packs, key=lambda pack: pack_priority(pack.file.name)
+        )
+
+        # All the packs containing each file, from the lowest priority
+        self.layers = {}
+        for pack in self.packs:
+            for name in pack.files():
+                self.layers.setdefault(name, []).append(pack)
+
+        self.names = sorted(self.layers.keys())
+
+    def __contains__(self, name):
+        return name in self.layers
+
+    def __len__(self):
+        return len(self.names)
+
+    def files(self):
+        """Get a sorted list of all the files"""
+        return list(self.names)
+
+    def lookup(self, name):
+        """Get the pack a file should be read from"""
+        if name not in self.layers:
+            raise NameError("File not in any pack: %s" % name)
+        return self.layers[name][-1]
+
+    def lookup_all(self, name):
+        """Get all the packs containing a file, from the lowest priority"""
+        if name not in self.layers:
+            raise NameError("File not in any pack: %s" % name)
+        return list(self.layers[name])
+
+    def prefix(self, prefix):
+        """Get all the files starting with a prefix, sorted"""
+        start = bisect.bisect_left(self.names, prefix)
+        for name in self.names[start:]:
+            if not name.startswith(prefix):
+                break
+            yield name
+
+    def glob(self, pattern):
+        """Get all the files matching a glob pattern, sorted
+
+        Only the names starting with the literal prefix of the pattern
+        are checked against it."""
+        special = GLOB_SPECIAL_RE.search(pattern)
+        if special is None:
+            if pattern in self.layers:
+                yield pattern
+            return
+
+        for name in self.prefix(pattern[:special.start()]):
+            if fnmatch.fnmatchcase(name, pattern):
+                yield name
+
+    def close(self):
+        """Close all the packs"""
+        for pack in self.packs:
+            pack.close()
+
+
+def open(paths, use_mmap=False, cache_dir=None):
+    """Open multiple .fpk archives as a single PackSet"""
+    packs = []
+    try:
+        for path in paths:
+            packs.append(fpk.open(path, use_mmap, cache_dir))
+    except BaseException:
+        for pack in packs:
+            pack.close()
+        raise
+
+    return PackSet(packs)
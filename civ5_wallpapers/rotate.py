@@ -0,0 +1,113 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import sys
+
+from . import applier
+from . import store
+
+
+# This is the entry point run by cron and timers, so it imports only what's
+# needed to change the wallpaper: keep argparse and the extraction machinery
+# out of here
+
+DEFAULT_OUTPUT_DIR = "~/.cache/civ5-wallpapers"
+
+USAGE = "usage: civ5-wallpapers-rotate [-d DIRECTORY] {%s}" % ",".join(
+    applier.supported_des()
+)
+
+
+def wallpapers_directory(directory):
+    """Expand the path of a wallpapers directory
+
+    If the user didn't extract the wallpapers by themselves, the default
+    directory shows the ones in the system-wide store."""
+    directory = os.path.expanduser(directory)
+    store.update_view(
+        directory, create=directory == os.path.expanduser(DEFAULT_OUTPUT_DIR)
+    )
+    return directory
+
+
+def set_random(de, directory):
+    """Set a random wallpaper, exiting with an error if it's not possible"""
+    directory = wallpapers_directory(directory)
+
+    if not os.path.exists(directory):
+        print("Error: directory '%s' doesn't exist!" % directory)
+        if os.path.expanduser(DEFAULT_OUTPUT_DIR) == directory:
+            print("Please extract the wallpapers from Civilization 5 with:")
+            print("$ civ5-wallpapers extract")
+        exit(1)
+
+    wallpaper = applier.get_random_wallpaper(
+        directory, applier.screen_resolution()
+    )
+    if wallpaper is None:
+        print("Error: no wallpapers found in '%s'!" % directory)
+        exit(1)
+
+    if not applier.set_wallpaper(de, wallpaper):
+        print("Unsupported desktop environment: %s" % de)
+        exit(1)
+
+
+def parse_args(argv):
+    """Parse the command line arguments, returning (de, directory)"""
+    de = None
+    directory = DEFAULT_OUTPUT_DIR
+
+    args = iter(argv)
+    for arg in args:
+        if arg in ("-h", "--help"):
+            print(USAGE)
+            exit()
+        elif arg in ("-d", "--directory"):
+            directory = next(args, None)
+            if directory is None:
+                raise ValueError("%s requires an argument" % arg)
+        elif arg.startswith("--directory="):
+            directory = arg.split("=", 1)[1]
+        elif arg.startswith("-"):
+            raise ValueError("unknown option: %s" % arg)
+        elif de is None:
+            de = arg
+        else:
+            raise ValueError("unexpected argument: %s" % arg)
+
+    if de not in applier.supported_des():
+        raise ValueError("a supported desktop environment is required")
+    return de, directory
+
+
+def main(argv=None):
+    """Entry point of civ5-wallpapers-rotate"""
+    if argv is None:
+        argv = sys.argv[1:]
+
+    try:
+        de, directory = parse_args(argv)
+    except ValueError as e:
+        print(USAGE, file=sys.stderr)
+        print("Error: %s" % e, file=sys.stderr)
+        exit(2)
+
+    set_random(de, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+
+PROC_DIR = "/proc"
+SESSION_PROCESS = "gnome-session"
+
+# The last discovered session is cached here
+DEFAULT_STATE_FILE = "~/.cache/civ5-wallpapers/.cache/session.json"
+
+
+class SessionError(Exception):
+    pass
+
+
+def process_start_time(proc, pid):
+    """Get the start time of a process, or None if it isn't running"""
+    try:
+        with open(os.path.join(proc, str(pid), "stat")) as f:
+            stat = f.read()
+    except OSError:
+        return
+
+    # The process name can contain spaces and parens, skip after the last one
+    fields = stat[stat.rfind(")") + 2:].split()
+    try:
+        return int(fields[19])
+    except (IndexError, ValueError):
+        return
+
+
+def process_bus_address(proc, pid):
+    """Get the session bus address from the environment of a process"""
+    try:
+        with open(os.path.join(proc, str(pid), "environ"), "rb") as f:
+            environ = f.read()
+    except OSError:
+        return
+
+    for line in environ.split(b"\0"):
+        key, _, value = line.partition(b"=")
+        if key == b"DBUS_SESSION_BUS_ADDRESS":
+            return value.decode("utf-8", "replace")
+
+
+def find_sessions(proc=PROC_DIR, uid=None):
+    """Find the desktop sessions of an user, as (start time, pid) tuples"""
+    if uid is None:
+        uid = os.getuid()
+
+    with os.scandir(proc) as entries:
+        for entry in entries:
+            if not entry.name.isdigit():
+                continue
+
+            try:
+                if entry.stat().st_uid != uid:
+                    continue
+                with open(os.path.join(entry.path, "comm")) as f:
+                    comm = f.read().strip()
+            except OSError:
+                continue  # The process exited in the meantime
+
+            if SESSION_PROCESS not in comm:
+                continue
+
+            start_time = process_start_time(proc, entry.name)
+            if start_time is not None:
+                yield start_time, int(entry.name)
+
+
+def load_state(state_file):
+    """Load the cached session, if present"""
+    try:
+        with open(state_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return
+
+
+def save_state(state_file, state):
+    """Save the cached session"""
+    try:
+        directory = os.path.dirname(state_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(state_file + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(state_file + ".tmp", state_file)
+    except OSError:
+        pass  # The processes are simply scanned again next time
+
+
+def find_bus_address(proc=PROC_DIR, state_file=DEFAULT_STATE_FILE, uid=None):
+    """Find the session bus address of the current user's desktop session
+
+    The address is cached in the state file, and reused as long as the
+    session process it was read from is still running. If the user has
+    multiple sessions the most recent one is used."""
+    state_file = os.path.expanduser(state_file)
+
+    state = load_state(state_file)
+    if isinstance(state, dict) and "pid" in state:
+        start_time = process_start_time(proc, state["pid"])
+        if start_time is not None and start_time == state.get("start_time"):
+            return state["address"]
+
+    for start_time, pid in sorted(find_sessions(proc, uid), reverse=True):
+        address = process_bus_address(proc, pid)
+        if address is None:
+            continue
+
+        save_state(state_file, {
+            "pid": pid,
+            "start_time": start_time,
+            "address": address,
+        })
+        return address
+
+    raise SessionError("Can't find a running %s" % SESSION_PROCESS)
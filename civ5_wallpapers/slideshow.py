@@ -0,0 +1,162 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from xml.sax.saxutils import escape
+import random
+import json
+import os
+
+from . import applier
+
+
+# GNOME rotates the wallpapers listed in this file by itself
+SLIDESHOW_FILE = "slideshow.xml"
+SLIDESHOW_STATE = ".cache/slideshow.json"
+
+# Minutes each wallpaper is shown, and seconds of the transition
+DEFAULT_INTERVAL = 60
+DEFAULT_TRANSITION = 5
+
+
+def load_state(directory):
+    """Load the settings and the order of a directory's slideshow"""
+    try:
+        with open(os.path.join(directory, SLIDESHOW_STATE)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    if not isinstance(state, dict):
+        return
+    return state
+
+
+def save_state(directory, state):
+    """Save the settings and the order of a directory's slideshow"""
+    path = os.path.join(directory, SLIDESHOW_STATE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def update_order(order, files):
+    """Update the order of the slideshow with the current wallpapers
+
+    Removed wallpapers are dropped and new ones are inserted at random
+    positions, without shuffling the existing ones again."""
+    existing = set(files)
+    known = set(order)
+
+    order = [file for file in order if file in existing]
+    for file in files:
+        if file not in known:
+            order.insert(random.randint(0, len(order)), file)
+    return order
+
+
+def render(wallpapers, interval, transition):
+    """Render the slideshow XML of some wallpapers
+
+    Every wallpaper is shown for ``interval`` seconds, including the
+    ``transition`` seconds spent fading into the next one."""
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        "<background>",
+        "  <starttime>",
+        "    <year>2016</year>",
+        "    <month>01</month>",
+        "    <day>01</day>",
+        "    <hour>00</hour>",
+        "    <minute>00</minute>",
+        "    <second>00</second>",
+        "  </starttime>",
+    ]
+
+    fade = transition > 0 and len(wallpapers) > 1
+    static = max(interval - transition, 1) if fade else interval
+    for i, wallpaper in enumerate(wallpapers):
+        lines += [
+            "  <static>",
+            "    <duration>%.1f</duration>" % static,
+            "    <file>%s</file>" % escape(wallpaper),
+            "  </static>",
+        ]
+
+        if fade:
+            following = wallpapers[(i + 1) % len(wallpapers)]
+            lines += [
+                '  <transition type="overlay">',
+                "    <duration>%.1f</duration>" % transition,
+                "    <from>%s</from>" % escape(wallpaper),
+                "    <to>%s</to>" % escape(following),
+                "  </transition>",
+            ]
+
+    lines.append("</background>")
+    return "\n".join(lines) + "\n"
+
+
+def update(directory, interval=None, transition=None):
+    """Create or update the slideshow of the wallpapers in a directory
+
+    The interval (in minutes) and the transition (in seconds) default to
+    the ones used last time. The XML file is rewritten only if its content
+    changed, and its path is returned."""
+    directory = os.path.abspath(directory)
+    state = load_state(directory) or {}
+
+    if interval is None:
+        interval = state.get("interval", DEFAULT_INTERVAL)
+    if transition is None:
+        transition = state.get("transition", DEFAULT_TRANSITION)
+
+    files = sorted(
+        file for file in os.listdir(directory)
+        if file.endswith(applier.WALLPAPER_EXTENSIONS)
+    )
+    order = update_order(state.get("order", []), files)
+
+    resolution = applier.screen_resolution()
+    content = render([
+        applier.resolution_variant(os.path.join(directory, file), resolution)
+        for file in order
+    ], interval * 60, transition)
+
+    path = os.path.join(directory, SLIDESHOW_FILE)
+    try:
+        with open(path) as f:
+            changed = f.read() != content
+    except OSError:
+        changed = True
+
+    if changed:
+        with open(path + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+    save_state(directory, {
+        "interval": interval,
+        "transition": transition,
+        "order": order,
+    })
+    return path
+
+
+def refresh(directory):
+    """Update the slideshow of a directory, only if it was created before"""
+    if load_state(directory) is None:
+        return
+    return update(directory)
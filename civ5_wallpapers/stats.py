@@ -0,0 +1,207 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import contextlib
+import json
+import time
+import sys
+
+
+# The stages of an extraction, in the order they're reported
+STAGES = ["parse", "read", "convert", "write"]
+
+MB = 1024 * 1024
+
+
+class Stats:
+    """Timing and throughput statistics collected during an extraction
+
+    Stages running in parallel worker processes are collected by each
+    worker in its own instance, and merged back afterwards: their wall
+    time is thus the total time spent in them across all the workers."""
+
+    def __init__(self):
+        self.stages = {
+            stage: {"wall": 0.0, "cpu": 0.0, "calls": 0} for stage in STAGES
+        }
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.members = 0
+        self.packs = {}
+        self.wall = 0.0
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Measure the time spent in a stage"""
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            stage = self.stages[name]
+            stage["wall"] += time.perf_counter() - wall
+            stage["cpu"] += time.process_time() - cpu
+            stage["calls"] += 1
+
+    @contextlib.contextmanager
+    def total(self):
+        """Measure the total wall time of the extraction"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.wall += time.perf_counter() - start
+
+    def member(self, pack, size, elapsed):
+        """Record a member extracted from a pack"""
+        self.members += 1
+        self.bytes_read += size
+
+        stats = self.packs.setdefault(pack, {
+            "members": 0, "bytes": 0, "time": 0.0,
+        })
+        stats["members"] += 1
+        stats["bytes"] += size
+        stats["time"] += elapsed
+
+    def written(self, size):
+        """Record some bytes written to the output directory"""
+        self.bytes_written += size
+
+    def merge(self, other):
+        """Merge the statistics collected by another instance"""
+        for name, stage in other.stages.items():
+            for key, value in stage.items():
+                self.stages[name][key] += value
+
+        self.bytes_read += other.bytes_read
+        self.bytes_written += other.bytes_written
+        self.members += other.members
+
+        for pack, stats in other.packs.items():
+            current = self.packs.setdefault(pack, {
+                "members": 0, "bytes": 0, "time": 0.0,
+            })
+            for key, value in stats.items():
+                current[key] += value
+
+    def as_dict(self):
+        """Get the statistics in a JSON-serializable format"""
+        return {
+            "wall": self.wall,
+            "stages": self.stages,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "members": self.members,
+            "packs": {
+                pack: dict(stats, throughput=throughput(stats))
+                for pack, stats in self.packs.items()
+            },
+        }
+
+    def report(self, format="text"):
+        """Get a report of the statistics, as text or JSON"""
+        if format == "json":
+            return json.dumps(self.as_dict(), indent=2, sort_keys=True)
+
+        lines = ["%-10s %10s %10s %8s" % ("stage", "wall", "cpu", "calls")]
+        for name in STAGES:
+            stage = self.stages[name]
+            lines.append("%-10s %9.3fs %9.3fs %8s" % (
+                name, stage["wall"], stage["cpu"], stage["calls"],
+            ))
+
+        lines.append("")
+        lines.append("Members extracted: %s" % self.members)
+        lines.append("Read: %.1f MB, written: %.1f MB, total time: %.3fs" % (
+            self.bytes_read / MB, self.bytes_written / MB, self.wall,
+        ))
+
+        for pack, stats in sorted(self.packs.items()):
+            lines.append("%s: %s members, %.1f MB, %.1f MB/s" % (
+                pack, stats["members"], stats["bytes"] / MB,
+                throughput(stats) / MB,
+            ))
+
+        return "\n".join(lines)
+
+
+def throughput(stats):
+    """Get the throughput (in bytes per second) of a pack's statistics"""
+    if not stats["time"]:
+        return 0.0
+    return stats["bytes"] / stats["time"]
+
+
+class Progress:
+    """Progress of an extraction, shown as items/s and MB/s
+
+    The progress line is rewritten in place at most every ``interval``
+    seconds, and it's shown only if the stream is a terminal."""
+
+    def __init__(self, stream=sys.stderr, interval=0.5):
+        self.stream = stream
+        self.interval = interval
+        self.enabled = stream.isatty()
+
+        self.total_items = 0
+        self.total_bytes = 0
+        self.items = 0
+        self.bytes = 0
+        self.started = None
+        self.shown = None
+
+    def start(self, items, size):
+        """Start tracking the extraction of some items"""
+        self.total_items = items
+        self.total_bytes = size
+        self.items = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+        self.shown = None
+
+    def update(self, items, size):
+        """Record some items extracted"""
+        self.items += items
+        self.bytes += size
+
+        now = time.perf_counter()
+        if self.shown is None or now - self.shown >= self.interval:
+            self.shown = now
+            self.show(now)
+
+    def show(self, now):
+        """Show the current progress"""
+        if not self.enabled:
+            return
+
+        elapsed = max(now - self.started, 1e-9)
+        self.stream.write("\r%s/%s items, %.1f/%.1f MB, %.0f items/s, "
+                          "%.1f MB/s " % (
+            self.items, self.total_items, self.bytes / MB,
+            self.total_bytes / MB, self.items / elapsed,
+            self.bytes / elapsed / MB,
+        ))
+        self.stream.flush()
+
+    def finish(self):
+        """Show the final progress"""
+        if self.started is None or not self.total_items:
+            return
+
+        self.show(time.perf_counter())
+        if self.enabled:
+            self.stream.write("\n")
+            self.stream.flush()
@@ -0,0 +1,265 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import re
+
+
+CIV5_APP_ID = "8930"
+
+# Where Steam is usually installed
+STEAM_ROOTS = [
+    "~/.steam/root",
+    "~/.steam/steam",
+    "~/.local/share/Steam",
+    "~/.var/app/com.valvesoftware.Steam/.local/share/Steam",
+]
+
+# Where the list of library folders is stored, relative to the Steam root
+LIBRARY_FOLDERS_FILES = [
+    "steamapps/libraryfolders.vdf",
+    "config/libraryfolders.vdf",
+]
+
+# Resources directories, relative to the game install directory
+ASSETS_DIR = "steamassets"
+DLC_DIR = "steamassets/assets/dlc"
+
+# Relative to the resources directories, mirrors extractor.PACKS_DIR
+PACKS_DIR = "resource/dx9"
+
+# The results of the last scan are cached here
+DEFAULT_CACHE_FILE = "~/.cache/civ5-wallpapers/.cache/steam.json"
+
+vdf_token_re = re.compile(r'"((?:[^"\\]|\\.)*)"|([{}])|//[^\n]*|\s+')
+
+
+class VdfError(Exception):
+    pass
+
+
+def parse_vdf(content):
+    """Parse Valve's KeyValues text format into nested dicts"""
+    stack = [{}]
+    key = None
+
+    pos = 0
+    while pos < len(content):
+        match = vdf_token_re.match(content, pos)
+        if match is None:
+            raise VdfError("Unexpected character at position %s" % pos)
+        pos = match.end()
+
+        string, brace = match.groups()
+        if string is not None:
+            string = re.sub(r"\\(.)", r"\1", string)
+            if key is None:
+                key = string
+            else:
+                stack[-1][key] = string
+                key = None
+        elif brace == "{":
+            if key is None:
+                raise VdfError("Block without a key at position %s" % pos)
+            child = {}
+            stack[-1][key] = child
+            stack.append(child)
+            key = None
+        elif brace == "}":
+            if len(stack) == 1:
+                raise VdfError("Unbalanced braces at position %s" % pos)
+            stack.pop()
+
+    if len(stack) != 1:
+        raise VdfError("Unbalanced braces at the end of the file")
+    return stack[0]
+
+
+def load_vdf(path):
+    """Load a .vdf or .acf file, returning None if it can't be read"""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return parse_vdf(f.read())
+    except (OSError, VdfError):
+        return
+
+
+def library_folders(root):
+    """Get all the Steam library folders known by a Steam root"""
+    folders = [root]
+
+    for name in LIBRARY_FOLDERS_FILES:
+        content = load_vdf(os.path.join(root, name))
+        if content is None:
+            continue
+
+        for section in content.values():
+            if not isinstance(section, dict):
+                continue
+
+            for key, value in section.items():
+                if not key.isdigit():
+                    continue
+
+                # Old format: "1" "/path", new format: "1" { "path" "..." }
+                if isinstance(value, dict):
+                    value = value.get("path")
+                if isinstance(value, str):
+                    folders.append(value)
+
+    return folders
+
+
+def app_manifest(folder):
+    """Get the path of the game's app manifest in a library folder"""
+    return os.path.join(
+        folder, "steamapps", "appmanifest_%s.acf" % CIV5_APP_ID
+    )
+
+
+def find_installs(roots=STEAM_ROOTS):
+    """Find all the Civilization V installs in the Steam libraries"""
+    seen = set()
+    for root in roots:
+        root = os.path.expanduser(root)
+        if not os.path.isdir(root):
+            continue
+
+        for folder in library_folders(root):
+            steamapps = os.path.join(folder, "steamapps")
+            manifest = load_vdf(app_manifest(folder))
+            if manifest is None:
+                continue
+
+            install_dir = manifest.get("AppState", {}).get("installdir")
+            if not isinstance(install_dir, str):
+                continue
+
+            path = os.path.realpath(
+                os.path.join(steamapps, "common", install_dir)
+            )
+            if path not in seen and os.path.isdir(path):
+                seen.add(path)
+                yield path
+
+
+def resource_dirs(install):
+    """Get the resources directories of an install, including the DLCs"""
+    base = os.path.join(install, ASSETS_DIR)
+    if os.path.isdir(os.path.join(base, PACKS_DIR)):
+        yield base
+
+    try:
+        with os.scandir(os.path.join(install, DLC_DIR)) as entries:
+            dlcs = sorted(entry.path for entry in entries if entry.is_dir())
+    except OSError:
+        return
+
+    for dlc in dlcs:
+        if os.path.isdir(os.path.join(dlc, PACKS_DIR)):
+            yield dlc
+
+
+def mtime(path):
+    """Get the modification time of a file, or None if it doesn't exist"""
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return
+
+
+def library_key(roots):
+    """Get the key identifying the library folders of the Steam roots
+
+    It changes whenever a root appears or disappears, or one of the files
+    listing its library folders changes."""
+    key = []
+    for root in roots:
+        root = os.path.expanduser(root)
+        key.append([root, os.path.isdir(root)])
+        for name in LIBRARY_FOLDERS_FILES:
+            key.append([root, name, mtime(os.path.join(root, name))])
+    return key
+
+
+def app_manifests(roots):
+    """Get the paths of the game's app manifests in every library folder"""
+    paths = []
+    for root in roots:
+        root = os.path.expanduser(root)
+        if os.path.isdir(root):
+            paths.extend(map(app_manifest, library_folders(root)))
+    return paths
+
+
+def load_cache(cache_file):
+    """Load the results of the last scan, or an empty dict"""
+    try:
+        with open(cache_file) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+    if not isinstance(cached, dict):
+        return {}
+    return cached
+
+
+def find_resource_dirs(roots=STEAM_ROOTS, cache_file=DEFAULT_CACHE_FILE):
+    """Find the resources directories of every Civilization V install
+
+    The result is cached, and the libraries are scanned again only if the
+    list of library folders or the game's app manifest change, a cached
+    directory disappears or the game wasn't found by the previous scan.
+    Steam updates the app manifest when a DLC is installed or removed."""
+    cache_file = os.path.expanduser(cache_file)
+    cached = load_cache(cache_file)
+
+    # The files listing the library folders are parsed again only if they
+    # changed since the last scan
+    libraries = library_key(roots)
+    manifests = cached.get("manifests")
+    valid = isinstance(manifests, list) and all(
+        isinstance(path, str) for path in manifests
+    )
+    if cached.get("libraries") != libraries or not valid:
+        manifests = app_manifests(roots)
+    key = [[path, mtime(path)] for path in manifests]
+
+    dirs = cached.get("dirs")
+    if (cached.get("libraries") == libraries and cached.get("key") == key
+            and isinstance(dirs, list) and dirs
+            and all(isinstance(path, str) and os.path.isdir(path)
+                    for path in dirs)):
+        return dirs
+
+    dirs = [
+        path for install in find_installs(roots)
+        for path in resource_dirs(install)
+    ]
+
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(cache_file + ".tmp", "w") as f:
+            json.dump({
+                "libraries": libraries, "manifests": manifests, "key": key,
+                "dirs": dirs,
+            }, f)
+        os.replace(cache_file + ".tmp", cache_file)
+    except OSError:
+        pass  # Scanning the libraries again next time is still correct
+
+    return dirs
@@ -0,0 +1,151 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import os
+
+from . import applier
+
+
+# The wallpapers extracted once for all the users of the machine
+SYSTEM_DIR = "/var/cache/civ5-wallpapers"
+
+# Users see the shared wallpapers through a directory of symlinks to them,
+# which keeps the rotation state of every user separated. This file, relative
+# to that directory, records which store it links to
+VIEW_STATE = ".cache/view.json"
+
+# The manifest written by every extraction (manifest.MANIFEST_FILE), which
+# isn't imported so the rotation doesn't have to load the archive parser
+MANIFEST_FILE = ".manifest.json"
+
+
+def load_view(directory):
+    """Load the state of a view, if it's one"""
+    try:
+        with open(os.path.join(directory, VIEW_STATE)) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return
+
+    if not isinstance(state, dict):
+        return
+    return state
+
+
+def shared_entries(source):
+    """Get the names of the wallpapers and the subdirectories in the store"""
+    names = set()
+    with os.scandir(source) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue  # Caches, manifest and temporary files
+            if entry.is_dir() or entry.name.endswith(
+                applier.WALLPAPER_EXTENSIONS
+            ):
+                names.add(entry.name)
+    return names
+
+
+def sync_view(source, directory):
+    """Link all the wallpapers of the store into a view
+
+    The subdirectories with the scaled wallpapers are linked as a whole.
+    Links to wallpapers removed from the store are removed, while files
+    which aren't links are never touched."""
+    os.makedirs(directory, exist_ok=True)
+    names = shared_entries(source)
+
+    for name in names:
+        try:
+            os.symlink(
+                os.path.join(source, name), os.path.join(directory, name)
+            )
+        except FileExistsError:
+            pass
+
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.name in names or not entry.is_symlink():
+                continue
+            target = os.readlink(entry.path)
+            if os.path.dirname(target) == source:
+                os.remove(entry.path)
+
+
+def has_wallpapers(directory):
+    """Check if the user extracted some wallpapers in a directory
+
+    The directory itself might exist only because of the caches kept in
+    it, so only the manifest and the wallpapers are looked for."""
+    if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        return True
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return False
+    return any(name.endswith(applier.WALLPAPER_EXTENSIONS) for name in names)
+
+
+def update_view(directory, source=SYSTEM_DIR, create=False):
+    """Keep a view of the system-wide store up to date
+
+    Existing views are synced again only when the store changed, and their
+    slideshow is updated with them. A new view is created only if
+    ``create`` is true and the user didn't extract any wallpaper in the
+    directory, so they're never mixed with the shared ones. Returns
+    whether the directory is a view."""
+    try:
+        mtime = os.stat(source).st_mtime_ns
+    except OSError:
+        return False
+
+    state = load_view(directory)
+    if state is None and (not create or has_wallpapers(directory)):
+        return False
+    if state == {"source": source, "mtime": mtime}:
+        return True
+
+    try:
+        sync_view(source, directory)
+
+        path = os.path.join(directory, VIEW_STATE)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump({"source": source, "mtime": mtime}, f)
+        os.replace(path + ".tmp", path)
+
+        # Only imported here to keep the rotation startup fast
+        from . import slideshow
+        slideshow.refresh(directory)
+    except OSError:
+        return state is not None
+    return True
+
+
+def remove_view(directory):
+    """Turn a view back into a normal directory, removing all its links"""
+    state = load_view(directory)
+    if state is None:
+        return
+
+    source = state.get("source")
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_symlink():
+                continue
+            if os.path.dirname(os.readlink(entry.path)) == source:
+                os.remove(entry.path)
+    os.remove(os.path.join(directory, VIEW_STATE))
@@ -0,0 +1,220 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import hashlib
+import time
+import os
+
+from . import extractor
+from . import manifest
+from . import ioplan
+from . import fpk
+from .stats import Stats
+
+
+# Size of the reads done while hashing the members of a pack
+READ_BUFFER = 1024 * 1024 * 4
+
+# Packs are hashed in ranges of about this size, in parallel
+RANGE_SIZE = 1024 * 1024 * 64
+
+
+def check_pack(path):
+    """Run all the structural checks on a pack, returning its members
+
+    The members are returned as (name, offset, size) tuples, sorted by
+    offset. The cached table of contents is never used here."""
+    pack = fpk.open(path)
+    try:
+        size = os.fstat(pack.file.fileno()).st_size
+        key = fpk.toc_cache_key(pack.file)
+
+        members = sorted(
+            zip(pack.names, pack.offsets, pack.sizes), key=lambda m: m[1]
+        )
+        for name, offset, member_size in members:
+            if offset + member_size > size:
+                raise fpk.FpkError(
+                    "Item %s goes past the end of the archive" % name
+                )
+    finally:
+        pack.close()
+
+    return members, key
+
+
+def hash_members(path, members, buffer=READ_BUFFER):
+    """Hash contiguous members of a pack with large sequential reads
+
+    Returns a dict with the hash of each member, the same as the one
+    returned by manifest.digest()."""
+    start = members[0][1]
+    end = members[-1][1] + members[-1][2]
+
+    hashes = {}
+    data = memoryview(bytearray(buffer))
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(
+                f.fileno(), start, end - start, os.POSIX_FADV_SEQUENTIAL
+            )
+        f.seek(start)
+
+        i = 0
+        hasher = hashlib.sha256()
+        pos = start
+        while pos < end:
+            read = f.readinto(data[:min(buffer, end - pos)])
+            if not read:
+                raise fpk.FpkError("Unexpected end of the archive")
+
+            # Feed every member overlapping with the chunk just read
+            while i < len(members):
+                name, offset, size = members[i]
+                if offset >= pos + read:
+                    break
+
+                chunk_start = max(offset, pos) - pos
+                chunk_end = min(offset + size, pos + read) - pos
+                hasher.update(data[chunk_start:chunk_end])
+                if offset + size > pos + read:
+                    break
+
+                hashes[name] = hasher.hexdigest()
+                hasher = hashlib.sha256()
+                i += 1
+
+            pos += read
+
+    return hashes
+
+
+def _hash_range(path, members):
+    """Hash a range of members, returning their hashes and the statistics"""
+    stats = Stats()
+    start = time.perf_counter()
+    with stats.stage("read"):
+        hashes = hash_members(path, members)
+    elapsed = time.perf_counter() - start
+
+    # The time is split between the members proportionally to their size
+    total = sum(size for _, _, size in members)
+    for _, _, size in members:
+        stats.member(path, size, elapsed * size / total)
+    return hashes, stats
+
+
+def verify(resources_dirs, dest, jobs=None, stats=None):
+    """Verify the integrity of the packs and of the extracted wallpapers
+
+    Every pack is fully checked and all its members are hashed, by ``jobs``
+    threads at a time (by default one for each CPU). The members and the
+    wallpapers recorded in the manifest of the ``dest`` directory are then
+    compared with the recorded hashes. A list of the problems found is
+    returned, empty if everything is fine."""
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if stats is None:
+        stats = Stats()
+
+    with stats.total():
+        return _verify(resources_dirs, dest, jobs, stats)
+
+
+def _verify(resources_dirs, dest, jobs, stats):
+    """Implementation of verify()"""
+    problems = []
+    outputs = manifest.load(dest)
+
+    packs = {}
+    for path in extractor.find_packs(resources_dirs):
+        path = os.path.abspath(path)
+        try:
+            with stats.stage("parse"):
+                packs[path] = check_pack(path)
+        except (fpk.FpkError, OSError) as e:
+            problems.append("%s: %s" % (path, e))
+
+    ranges = ioplan.plan([
+        (path, name, offset, size)
+        for path, (members, _) in packs.items()
+        for name, offset, size in members
+    ], max_size=RANGE_SIZE)
+
+    hashes = {path: {} for path in packs}
+    failed = set()
+    with concurrent.futures.ThreadPoolExecutor(jobs) as executor:
+        futures = {}
+        for extent in ranges:
+            future = executor.submit(_hash_range, extent.path, extent.members)
+            futures[future] = extent.path
+
+        output_futures = {}
+        for name, existing in sorted(outputs.items()):
+            if not isinstance(existing, dict):
+                continue
+            for output in sorted(existing.get("outputs", {})):
+                future = executor.submit(
+                    manifest.file_digest, os.path.join(dest, output)
+                )
+                output_futures[future] = name, output
+
+        for future, path in futures.items():
+            try:
+                range_hashes, range_stats = future.result()
+            except (fpk.FpkError, OSError) as e:
+                problems.append("%s: %s" % (path, e))
+                failed.add(path)
+                continue
+            hashes[path].update(range_hashes)
+            stats.merge(range_stats)
+
+        # Members recorded in the manifest
+        for name, existing in sorted(outputs.items()):
+            if not isinstance(existing, dict):
+                continue
+
+            for recorded in [existing] + existing.get("duplicates", []):
+                path = recorded.get("pack")
+                if path not in packs or path in failed:
+                    continue
+
+                member = recorded.get("member")
+                if recorded.get("pack_key") != packs[path][1]:
+                    problems.append(
+                        "%s: the pack changed since it was extracted, "
+                        "run the extraction again" % name
+                    )
+                elif hashes[path].get(member) != existing.get("hash"):
+                    problems.append("%s: member %s in %s is corrupted" % (
+                        name, member, path,
+                    ))
+
+        # Wallpapers extracted in the output directory
+        for future, (name, output) in output_futures.items():
+            try:
+                content_hash = future.result()
+            except OSError as e:
+                problems.append("%s: %s can't be read: %s" % (
+                    name, output, e.strerror or e,
+                ))
+                continue
+            if content_hash is None:
+                problems.append("%s: %s is missing" % (name, output))
+            elif content_hash != outputs[name]["outputs"][output]:
+                problems.append("%s: %s is corrupted" % (name, output))
+
+    return problems
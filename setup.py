@@ -52,9 +52,17 @@ setuptools.setup(
         "civ5_wallpapers",
     ],
 
+    extras_require = {
+        "fast": [
+            "numpy",
+            "Pillow",
+        ],
+    },
+
     entry_points = {
         "console_scripts": [
-            "civ5-wallpapers = civ5_wallpapers.cli:main"
+            "civ5-wallpapers = civ5_wallpapers.cli:main",
+            "civ5-wallpapers-rotate = civ5_wallpapers.rotate:main",
         ]
     },
 
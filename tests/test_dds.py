@@ -0,0 +1,118 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import io
+
+from benchmarks import synthetic
+
+# The decoder needs the optional numpy and Pillow dependencies
+try:
+    import numpy
+    import PIL.Image
+    from civ5_wallpapers import dds
+except ImportError:
+    dds = None
+
+
+FORMATS = [b"DXT1", b"DXT3", b"DXT5"]
+
+# Including sizes which aren't a multiple of the 4x4 blocks
+SIZES = [(1, 1), (4, 4), (13, 7), (64, 33), (100, 60)]
+
+
+def pillow_decode(data):
+    """Decode a texture with Pillow, as the reference decoder"""
+    image = PIL.Image.open(io.BytesIO(data))
+    return numpy.asarray(image.convert("RGBA"))
+
+
+def level_texture(data, level):
+    """Build a texture whose only level is a mipmap level of another one"""
+    header = dds.DdsHeader(data)
+    width, height = header.level_dimensions(level)
+    columns, rows = header.level_blocks(level)
+
+    offset = header.level_offset(level)
+    size = columns * rows * dds.BLOCK_SIZES[header.fourcc]
+    texture = synthetic.make_dds(width, height, header.fourcc)
+    return texture[:dds.HEADER_SIZE] + data[offset:offset + size]
+
+
+@unittest.skipIf(dds is None, "numpy and Pillow are not installed")
+class DecodeTests(unittest.TestCase):
+
+    def test_matches_pillow(self):
+        for fourcc in FORMATS:
+            for width, height in SIZES:
+                with self.subTest(fourcc=fourcc, size=(width, height)):
+                    data = synthetic.make_dds(width, height, fourcc, seed=3)
+                    decoded = dds.decode(data)
+
+                    self.assertEqual(decoded.shape, (height, width, 4))
+                    numpy.testing.assert_array_equal(
+                        decoded, pillow_decode(data)
+                    )
+
+    def test_mipmap_levels(self):
+        for fourcc in FORMATS:
+            data = synthetic.make_dds(100, 60, fourcc, mipmaps=4, seed=5)
+            for level in range(4):
+                with self.subTest(fourcc=fourcc, level=level):
+                    numpy.testing.assert_array_equal(
+                        dds.decode(data, level),
+                        pillow_decode(level_texture(data, level)),
+                    )
+
+    def test_bands(self):
+        for fourcc in FORMATS:
+            for width, height in SIZES:
+                data = synthetic.make_dds(width, height, fourcc, seed=7)
+                for rows in (1, 2, 8):
+                    with self.subTest(fourcc=fourcc, size=(width, height),
+                                      rows=rows):
+                        bands = list(dds.decode_bands(data, rows=rows))
+                        for band in bands[:-1]:
+                            self.assertEqual(band.shape[0], rows * 4)
+                        numpy.testing.assert_array_equal(
+                            numpy.concatenate(bands), dds.decode(data)
+                        )
+
+    def test_bands_mipmap_level(self):
+        data = synthetic.make_dds(100, 60, b"DXT5", mipmaps=3, seed=9)
+        numpy.testing.assert_array_equal(
+            numpy.concatenate(list(dds.decode_bands(data, 2, rows=1))),
+            dds.decode(data, 2),
+        )
+
+    def test_truncated(self):
+        data = synthetic.make_dds(64, 64, b"DXT1")
+        with self.assertRaises(dds.DdsError):
+            dds.decode(data[:-1])
+        with self.assertRaises(dds.DdsError):
+            dds.decode_bands(data[:-1])
+        with self.assertRaises(dds.DdsError):
+            dds.decode(data[:dds.HEADER_SIZE - 1])
+
+    def test_unsupported_format(self):
+        data = bytearray(synthetic.make_dds(8, 8, b"DXT1"))
+        data[84:88] = b"ATI2"
+        with self.assertRaises(dds.UnsupportedFormat):
+            dds.decode(bytes(data))
+
+    def test_missing_level(self):
+        data = synthetic.make_dds(8, 8, b"DXT1")
+        with self.assertRaises(dds.DdsError):
+            dds.decode(data, 1)
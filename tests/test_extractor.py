@@ -0,0 +1,198 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import mock
+import unittest
+import tempfile
+import os
+
+from civ5_wallpapers import extractor
+from civ5_wallpapers import manifest
+from civ5_wallpapers import packset
+from civ5_wallpapers import fpk
+
+from benchmarks import synthetic
+
+# Only needed by the tests of the decoder
+try:
+    import PIL.Image
+except ImportError:
+    pass
+
+
+TEXTURE = synthetic.make_dds(8, 8)
+
+# Members with names which must never be extracted as wallpapers
+ITEMS = [
+    ("loading_1.dds", TEXTURE),
+    ("loading_12.dds", TEXTURE),
+    ("loading_3_small.dds", TEXTURE),
+    ("loading_x.dds", TEXTURE),
+    ("loading_2/../../evil.dds", TEXTURE),
+    ("/absolute.dds", TEXTURE),
+    ("../evil.txt", b"evil"),
+    ("readme.txt", b"hello"),
+]
+
+
+class NamesTests(unittest.TestCase):
+
+    def test_is_wallpaper(self):
+        self.assertTrue(extractor.is_wallpaper("loading_1.dds"))
+        self.assertTrue(extractor.is_wallpaper("loading_123.dds"))
+        self.assertFalse(extractor.is_wallpaper("loading_.dds"))
+        self.assertFalse(extractor.is_wallpaper("loading_3_small.dds"))
+        self.assertFalse(extractor.is_wallpaper("loading_1/../2.dds"))
+        self.assertFalse(extractor.is_wallpaper("loading_².dds"))
+        self.assertFalse(extractor.is_wallpaper("loading_1.jpg"))
+
+    def test_is_safe_name(self):
+        self.assertTrue(fpk.is_safe_name("loading_1.dds"))
+        self.assertTrue(fpk.is_safe_name("1920x1080/loading_1.jpg"))
+        self.assertTrue(fpk.is_safe_name("a..b.dds"))
+        self.assertFalse(fpk.is_safe_name(""))
+        self.assertFalse(fpk.is_safe_name("/etc/passwd"))
+        self.assertFalse(fpk.is_safe_name(".."))
+        self.assertFalse(fpk.is_safe_name("a/../../b.dds"))
+
+
+class ExtractTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = self.tmp.name
+        self.game = synthetic.make_game_dir(
+            os.path.join(self.root, "game"), {"uitextures.fpk": ITEMS}
+        )
+        self.dest = os.path.join(self.root, "a", "b", "out")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def open_packs(self):
+        packs = packset.open(extractor.find_packs(self.game))
+        self.addCleanup(packs.close)
+        return packs
+
+    def test_select_loading_screens(self):
+        self.assertEqual(extractor.select_files(self.open_packs()), [
+            "loading_1.dds", "loading_12.dds",
+        ])
+
+    def test_select_skips_unsafe_names(self):
+        self.assertEqual(extractor.select_files(self.open_packs(), ["*"]), [
+            "loading_1.dds", "loading_12.dds", "loading_3_small.dds",
+            "loading_x.dds", "readme.txt",
+        ])
+
+    def test_extract_refuses_unsafe_names(self):
+        pack = fpk.open(list(extractor.find_packs(self.game))[0])
+        self.addCleanup(pack.close)
+
+        with self.assertRaises(fpk.FpkError):
+            pack.extract("../evil.txt", self.dest)
+        with self.assertRaises(fpk.FpkError):
+            pack.extract("readme.txt", self.dest, output="../evil.txt")
+        self.assertFalse(
+            os.path.exists(os.path.join(self.dest, "..", "evil.txt"))
+        )
+
+    @unittest.skipIf(extractor.dds is None, "numpy and Pillow are missing")
+    def test_extract_all_stays_in_dest(self):
+        extractor.extract_wallpapers(
+            self.game, self.dest, jobs=1, patterns=["*"],
+            settings=extractor.ConversionSettings(),
+        )
+
+        for directory, _, files in os.walk(self.root):
+            for file in files:
+                path = os.path.join(directory, file)
+                self.assertTrue(
+                    path.startswith(self.dest + os.sep)
+                    or path.startswith(self.game + os.sep), path,
+                )
+        self.assertTrue(
+            os.path.exists(os.path.join(self.dest, "readme.txt"))
+        )
+
+    def test_copy_without_decoder(self):
+        # Without numpy there are no worker processes: the members which
+        # don't need to be converted are copied by the main process
+        with mock.patch.object(extractor, "dds", None):
+            extractor.extract_wallpapers(
+                self.game, self.dest, jobs=2, patterns=["*.txt"],
+            )
+
+        with open(os.path.join(self.dest, "readme.txt"), "rb") as f:
+            self.assertEqual(f.read(), b"hello")
+        self.assertEqual(extractor._worker_packs, {})
+
+
+@unittest.skipIf(extractor.dds is None, "numpy and Pillow are missing")
+class DecodeTextureTests(unittest.TestCase):
+
+    def test_levels_decoded_once(self):
+        data = synthetic.make_dds(128, 128, mipmaps=3, seed=1)
+        outputs = [
+            ("a.png", (64, 64)), ("b.png", (32, 32)), ("c.png", (60, 60)),
+            ("d.png", None),
+        ]
+        settings = extractor.ConversionSettings(format="png")
+
+        with tempfile.TemporaryDirectory() as dest:
+            with mock.patch.object(
+                extractor.dds, "decode", wraps=extractor.dds.decode
+            ) as decode:
+                self.assertTrue(extractor.decode_texture(
+                    data, dest, outputs, settings, extractor.Stats(),
+                ))
+
+            self.assertEqual(
+                [call.args[1] for call in decode.call_args_list], [0, 1, 2]
+            )
+            for path, resolution in outputs:
+                with PIL.Image.open(os.path.join(dest, path)) as image:
+                    self.assertEqual(image.size, resolution or (128, 128))
+
+
+class PlanTests(unittest.TestCase):
+
+    def test_hashes_from_ranges(self):
+        items = [("loading_%s.dds" % i, synthetic.make_dds(8, 8, seed=i))
+                 for i in range(1, 6)]
+        items.append(("loading_9.dds", items[0][1]))
+
+        with tempfile.TemporaryDirectory() as tmp:
+            game = synthetic.make_game_dir(tmp, {"uitextures.fpk": items})
+            for use_mmap in (False, True):
+                with self.subTest(use_mmap=use_mmap):
+                    packs = packset.open(
+                        extractor.find_packs(game), use_mmap=use_mmap
+                    )
+                    wallpapers = extractor.plan_wallpapers(
+                        packs, manifest.Sources({})
+                    )
+                    hashes = {
+                        wallpaper.file: wallpaper.hash
+                        for wallpaper in wallpapers
+                    }
+                    packs.close()
+
+                    # The duplicate is found, and extracted only once
+                    self.assertEqual(sorted(hashes), [
+                        "loading_%s.dds" % i for i in range(1, 6)
+                    ])
+                    for name, data in items[:5]:
+                        self.assertEqual(hashes[name], manifest.digest(data))
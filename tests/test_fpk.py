@@ -0,0 +1,58 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import tempfile
+import os
+
+from civ5_wallpapers import fpk
+
+from benchmarks import synthetic
+
+
+class OpenTests(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "uitextures.fpk")
+
+    def open(self, use_mmap):
+        pack = fpk.open(self.path, use_mmap)
+        self.addCleanup(pack.close)
+        return pack
+
+    def test_members(self):
+        synthetic.write_pack(self.path, [("a.dds", b"aaa"), ("b", b"bb")])
+        for use_mmap in (False, True):
+            with self.subTest(use_mmap=use_mmap):
+                pack = self.open(use_mmap)
+                self.assertEqual(sorted(pack.files()), ["a.dds", "b"])
+                with pack.view("a.dds") as data:
+                    self.assertEqual(bytes(data), b"aaa")
+
+    def test_corrupted(self):
+        synthetic.write_pack(self.path, [("a.dds", b"aaa")])
+        with open(self.path, "rb") as f:
+            content = f.read()
+
+        # Empty files (like partial downloads) can't be memory-mapped
+        for data in [b"", b"x" * 100, content[:20]]:
+            with open(self.path, "wb") as f:
+                f.write(data)
+            for use_mmap in (False, True):
+                with self.subTest(size=len(data), use_mmap=use_mmap):
+                    with self.assertRaises(fpk.FpkError):
+                        self.open(use_mmap)
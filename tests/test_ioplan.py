@@ -0,0 +1,95 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import mock
+import unittest
+import tempfile
+import os
+
+from civ5_wallpapers import ioplan
+
+
+class PlanTests(unittest.TestCase):
+
+    def test_coalesce(self):
+        ranges = ioplan.plan([
+            ("b", "b1", 0, 10),
+            ("a", "a3", 1000, 10),
+            ("a", "a1", 0, 10),
+            ("a", "a2", 20, 30),
+        ], max_gap=100)
+
+        self.assertEqual(
+            [(extent.path, extent.offset, extent.size) for extent in ranges],
+            [("a", 0, 50), ("a", 1000, 10), ("b", 0, 10)],
+        )
+        self.assertEqual(
+            [name for name, _, _ in ranges[0].members], ["a1", "a2"]
+        )
+
+    def test_max_size(self):
+        ranges = ioplan.plan([
+            ("a", name, offset, 10)
+            for name, offset in [("1", 0), ("2", 10), ("3", 20)]
+        ], max_size=25)
+        self.assertEqual([extent.size for extent in ranges], [20, 10])
+
+
+@unittest.skipUnless(hasattr(os, "posix_fadvise"), "posix_fadvise missing")
+class ReadAheadTests(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "pack")
+        with open(self.path, "wb") as f:
+            f.write(bytes(1000))
+
+        # Three ranges of 100 bytes, with gaps between their members
+        self.ranges = ioplan.plan([
+            (self.path, name, offset, 40)
+            for name, offset in [
+                ("a", 0), ("b", 60), ("c", 300), ("d", 360), ("e", 600),
+                ("f", 660),
+            ]
+        ], max_gap=50)
+        self.assertEqual([extent.size for extent in self.ranges],
+                         [100, 100, 100])
+
+    def hinted(self, window, consume):
+        """Get the offsets hinted after consuming some members"""
+        with mock.patch.object(os, "posix_fadvise") as fadvise:
+            with ioplan.ReadAhead(self.ranges, window) as hints:
+                consume(hints)
+        return [call.args[1] for call in fadvise.call_args_list]
+
+    def test_window(self):
+        self.assertEqual(self.hinted(150, lambda hints: None), [0, 300])
+
+    def test_consume_counts_gaps(self):
+        # After two whole ranges the window reaches the last one, even if
+        # only 160 bytes of members were read
+        self.assertEqual(self.hinted(
+            101, lambda hints: hints.consume(["a", "b", "c", "d"])
+        ), [0, 300, 600])
+
+    def test_consume_out_of_order(self):
+        # Workers finish in any order, only the bytes they read matter
+        self.assertEqual(self.hinted(
+            101, lambda hints: hints.consume(["d"])
+        ), [0, 300])
+        self.assertEqual(self.hinted(
+            101, lambda hints: hints.consume(["d", "c"])
+        ), [0, 300, 600])
@@ -0,0 +1,189 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import tempfile
+import json
+import os
+
+from civ5_wallpapers import session
+
+
+class FakeProc:
+    """A fake /proc tree, with only the files read by the session module"""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path)
+
+    def add(self, pid, comm, start_time, address=None, uid=None):
+        """Add a process to the tree"""
+        directory = os.path.join(self.path, str(pid))
+        os.makedirs(directory)
+
+        with open(os.path.join(directory, "comm"), "w") as f:
+            f.write(comm + "\n")
+
+        # The start time is the 22nd field, the 20th after the name
+        with open(os.path.join(directory, "stat"), "w") as f:
+            f.write("%s (%s) S %s %s 0 0 0\n" % (
+                pid, comm, " ".join(["1"] * 18), start_time,
+            ))
+
+        environ = [b"HOME=/home/user"]
+        if address is not None:
+            environ.append(b"DBUS_SESSION_BUS_ADDRESS=" + address.encode())
+        with open(os.path.join(directory, "environ"), "wb") as f:
+            f.write(b"\0".join(environ) + b"\0")
+
+        if uid is not None:
+            os.chown(directory, uid, -1)
+
+    def remove(self, pid):
+        """Simulate a process exiting"""
+        directory = os.path.join(self.path, str(pid))
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+class FindBusAddressTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.proc = FakeProc(os.path.join(self.tmp.name, "proc"))
+        self.state_file = os.path.join(self.tmp.name, "state", "session.json")
+
+        # Processes which aren't desktop sessions are always present
+        self.proc.add(1, "systemd", 10, "unix:path=/wrong")
+        self.proc.add(50, "bash", 20)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def find(self, uid=None):
+        return session.find_bus_address(
+            self.proc.path, self.state_file, uid=uid
+        )
+
+    def test_no_session(self):
+        with self.assertRaises(session.SessionError):
+            self.find()
+
+    def test_single_session(self):
+        self.proc.add(100, "gnome-session-b", 500, "unix:path=/bus/a")
+        self.assertEqual(self.find(), "unix:path=/bus/a")
+
+    def test_most_recent_session(self):
+        self.proc.add(100, "gnome-session", 500, "unix:path=/bus/old")
+        self.proc.add(200, "gnome-session", 900, "unix:path=/bus/new")
+        self.proc.add(300, "gnome-session", 700, "unix:path=/bus/middle")
+        self.assertEqual(self.find(), "unix:path=/bus/new")
+
+    def test_session_without_address(self):
+        self.proc.add(100, "gnome-session", 500, "unix:path=/bus/a")
+        self.proc.add(200, "gnome-session", 900)
+        self.assertEqual(self.find(), "unix:path=/bus/a")
+
+    def test_other_users(self):
+        other = os.getuid() + 1
+        try:
+            self.proc.add(100, "gnome-session", 900, "unix:path=/bus/b",
+                          uid=other)
+        except PermissionError:
+            self.skipTest("changing the owner of files requires root")
+        self.proc.add(200, "gnome-session", 500, "unix:path=/bus/a")
+
+        self.assertEqual(self.find(), "unix:path=/bus/a")
+        os.remove(self.state_file)
+        self.assertEqual(self.find(uid=other), "unix:path=/bus/b")
+
+    def test_cached(self):
+        self.proc.add(100, "gnome-session", 500, "unix:path=/bus/a")
+        self.assertEqual(self.find(), "unix:path=/bus/a")
+
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f), {
+                "pid": 100, "start_time": 500, "address": "unix:path=/bus/a",
+            })
+
+        # The cached session is used without scanning the processes
+        self.proc.add(200, "gnome-session", 900, "unix:path=/bus/b")
+        self.assertEqual(self.find(), "unix:path=/bus/a")
+
+    def test_stale_pid(self):
+        self.proc.add(100, "gnome-session", 500, "unix:path=/bus/a")
+        self.find()
+
+        self.proc.remove(100)
+        self.proc.add(200, "gnome-session", 900, "unix:path=/bus/b")
+        self.assertEqual(self.find(), "unix:path=/bus/b")
+
+    def test_stale_start_time(self):
+        self.proc.add(100, "gnome-session", 500, "unix:path=/bus/a")
+        self.find()
+
+        # The PID was reused by a new session
+        self.proc.remove(100)
+        self.proc.add(100, "gnome-session", 800, "unix:path=/bus/b")
+        self.assertEqual(self.find(), "unix:path=/bus/b")
+
+    def test_corrupted_state(self):
+        os.makedirs(os.path.dirname(self.state_file))
+        with open(self.state_file, "w") as f:
+            f.write("{not json")
+
+        self.proc.add(100, "gnome-session", 500, "unix:path=/bus/a")
+        self.assertEqual(self.find(), "unix:path=/bus/a")
+
+    def test_state_file_without_directory(self):
+        self.proc.add(100, "gnome-session", 500, "unix:path=/bus/a")
+
+        cwd = os.getcwd()
+        os.chdir(self.tmp.name)
+        try:
+            self.state_file = "session.json"
+            self.assertEqual(self.find(), "unix:path=/bus/a")
+            self.assertTrue(os.path.exists("session.json"))
+        finally:
+            os.chdir(cwd)
+
+    def test_state_file_expanded(self):
+        self.proc.add(100, "gnome-session", 500, "unix:path=/bus/a")
+
+        home = os.environ.get("HOME")
+        os.environ["HOME"] = self.tmp.name
+        try:
+            self.state_file = "~/cache/session.json"
+            self.assertEqual(self.find(), "unix:path=/bus/a")
+        finally:
+            if home is None:
+                del os.environ["HOME"]
+            else:
+                os.environ["HOME"] = home
+
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tmp.name, "cache", "session.json")
+        ))
+
+
+class ProcessStartTimeTests(unittest.TestCase):
+
+    def test_name_with_spaces_and_parens(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            proc = FakeProc(os.path.join(tmp, "proc"))
+            proc.add(100, "a) b (c", 1234)
+            self.assertEqual(session.process_start_time(proc.path, 100), 1234)
+            self.assertIsNone(session.process_start_time(proc.path, 200))
@@ -0,0 +1,259 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import mock
+import unittest
+import tempfile
+import shutil
+import os
+
+from civ5_wallpapers import steam
+
+
+OLD_LIBRARY_FOLDERS = """
+"LibraryFolders"
+{
+    "TimeNextStatsReport"   "1234567890"
+    "ContentStatsID"        "-123"
+    "1"     "%s"
+}
+"""
+
+NEW_LIBRARY_FOLDERS = """
+"libraryfolders"
+{
+    "contentstatsid"    "-123"
+    "0"
+    {
+        "path"      "%s"
+        "label"     ""
+        "apps"
+        {
+            "8930"      "123456"
+        }
+    }
+    "1"
+    {
+        "path"      "%s"
+    }
+}
+"""
+
+APP_MANIFEST = """
+"AppState"
+{
+    "appid"         "8930"
+    "name"          "Sid Meier's Civilization V"
+    "installdir"    "%s"
+}
+"""
+
+GAME_DIR = "Sid Meier's Civilization V"
+
+
+class ParseVdfTests(unittest.TestCase):
+
+    def test_old_library_folders(self):
+        self.assertEqual(steam.parse_vdf(OLD_LIBRARY_FOLDERS % "/games"), {
+            "LibraryFolders": {
+                "TimeNextStatsReport": "1234567890",
+                "ContentStatsID": "-123",
+                "1": "/games",
+            },
+        })
+
+    def test_new_library_folders(self):
+        content = steam.parse_vdf(NEW_LIBRARY_FOLDERS % ("/a", "/b"))
+        folders = content["libraryfolders"]
+        self.assertEqual(folders["0"]["path"], "/a")
+        self.assertEqual(folders["0"]["apps"], {"8930": "123456"})
+        self.assertEqual(folders["1"], {"path": "/b"})
+
+    def test_escapes_and_comments(self):
+        self.assertEqual(steam.parse_vdf(
+            '// A comment\n"a" "C:\\\\Games \\"quoted\\""\n"b" { } // end'
+        ), {"a": 'C:\\Games "quoted"', "b": {}})
+
+    def test_errors(self):
+        for content in ['"a" {', '}', '{ }', '"a" "b" =']:
+            with self.subTest(content=content):
+                with self.assertRaises(steam.VdfError):
+                    steam.parse_vdf(content)
+
+
+class FindResourceDirsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, "steam")
+        self.cache_file = os.path.join(self.tmp.name, "cache", "steam.json")
+        os.makedirs(os.path.join(self.root, "steamapps"))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def library(self, name):
+        """Create an empty library folder"""
+        path = os.path.join(self.tmp.name, name)
+        os.makedirs(os.path.join(path, "steamapps"), exist_ok=True)
+        return path
+
+    def install(self, library, dlcs=()):
+        """Install the game in a library, returning its directory"""
+        self.write(steam.app_manifest(library), APP_MANIFEST % GAME_DIR)
+
+        install = os.path.join(library, "steamapps", "common", GAME_DIR)
+        os.makedirs(os.path.join(install, steam.ASSETS_DIR, steam.PACKS_DIR))
+        for dlc in dlcs:
+            self.add_dlc(install, dlc)
+        return install
+
+    def add_dlc(self, install, name):
+        os.makedirs(os.path.join(
+            install, steam.DLC_DIR, name, steam.PACKS_DIR
+        ))
+
+    def find(self):
+        return steam.find_resource_dirs([self.root], self.cache_file)
+
+    def test_not_installed(self):
+        self.assertEqual(self.find(), [])
+
+    def test_root_library(self):
+        install = self.install(self.root, ["expansion2", "dlc_01"])
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+            os.path.join(install, steam.DLC_DIR, "dlc_01"),
+            os.path.join(install, steam.DLC_DIR, "expansion2"),
+        ])
+
+    def test_dlc_without_packs(self):
+        install = self.install(self.root)
+        os.makedirs(os.path.join(install, steam.DLC_DIR, "shaders"))
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+        ])
+
+    def test_old_library_folders(self):
+        library = self.library("games")
+        self.write(
+            os.path.join(self.root, "steamapps", "libraryfolders.vdf"),
+            OLD_LIBRARY_FOLDERS % library,
+        )
+        install = self.install(library)
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+        ])
+
+    def test_multiple_libraries(self):
+        first = self.library("first")
+        second = self.library("second")
+        self.write(
+            os.path.join(self.root, "config", "libraryfolders.vdf"),
+            NEW_LIBRARY_FOLDERS % (first, second),
+        )
+        install_first = self.install(first)
+        install_second = self.install(second, ["dlc_01"])
+
+        self.assertEqual(self.find(), [
+            os.path.join(install_first, steam.ASSETS_DIR),
+            os.path.join(install_second, steam.ASSETS_DIR),
+            os.path.join(install_second, steam.DLC_DIR, "dlc_01"),
+        ])
+
+    def test_same_library_listed_twice(self):
+        self.write(
+            os.path.join(self.root, "steamapps", "libraryfolders.vdf"),
+            NEW_LIBRARY_FOLDERS % (self.root, self.root + "/."),
+        )
+        install = self.install(self.root)
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+        ])
+
+    def test_cache_hit(self):
+        install = self.install(self.root)
+        self.assertEqual(len(self.find()), 1)
+
+        # A DLC directory appearing without any change to the manifest
+        # isn't noticed, proving the cached result is used
+        self.add_dlc(install, "dlc_01")
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+        ])
+
+    def test_cache_hit_without_parsing(self):
+        library = self.library("games")
+        self.write(
+            os.path.join(self.root, "steamapps", "libraryfolders.vdf"),
+            OLD_LIBRARY_FOLDERS % library,
+        )
+        install = self.install(library)
+        self.assertEqual(len(self.find()), 1)
+
+        with mock.patch.object(steam, "parse_vdf") as parse_vdf:
+            self.assertEqual(self.find(), [
+                os.path.join(install, steam.ASSETS_DIR),
+            ])
+        parse_vdf.assert_not_called()
+
+    def test_cache_invalidated_by_dlc(self):
+        install = self.install(self.root)
+        self.assertEqual(len(self.find()), 1)
+
+        # Installing a DLC updates the app manifest
+        self.add_dlc(install, "dlc_01")
+        path = steam.app_manifest(self.root)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+            os.path.join(install, steam.DLC_DIR, "dlc_01"),
+        ])
+
+    def test_cache_invalidated_by_new_library(self):
+        self.assertEqual(self.find(), [])
+
+        library = self.library("games")
+        install = self.install(library)
+        self.write(
+            os.path.join(self.root, "steamapps", "libraryfolders.vdf"),
+            OLD_LIBRARY_FOLDERS % library,
+        )
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+        ])
+
+    def test_cache_invalidated_by_removed_dir(self):
+        install = self.install(self.root, ["dlc_01"])
+        self.assertEqual(len(self.find()), 2)
+
+        shutil.rmtree(os.path.join(install, steam.DLC_DIR, "dlc_01"))
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+        ])
+
+    def test_corrupted_cache(self):
+        install = self.install(self.root)
+        self.write(self.cache_file, "{not json")
+        self.assertEqual(self.find(), [
+            os.path.join(install, steam.ASSETS_DIR),
+        ])
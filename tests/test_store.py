@@ -0,0 +1,191 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import mock
+import contextlib
+import unittest
+import tempfile
+import io
+import os
+
+from civ5_wallpapers import extractor
+from civ5_wallpapers import manifest
+from civ5_wallpapers import slideshow
+from civ5_wallpapers import store
+from civ5_wallpapers import cli
+
+from benchmarks import synthetic
+
+
+class StoreTestCase(unittest.TestCase):
+    """A store with some wallpapers, and the path of a view of it"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.source = os.path.join(self.tmp.name, "store")
+        self.view = os.path.join(self.tmp.name, "home", "wallpapers")
+
+        os.makedirs(os.path.join(self.source, "1920x1080"))
+        self.write(self.source, "loading_1.jpg")
+        self.write(self.source, "loading_2.jpg")
+        self.write(self.source, manifest.MANIFEST_FILE)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, directory, name, content="data"):
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+        return path
+
+    def touch_source(self):
+        """Make sure the store looks changed, whatever the mtime resolution"""
+        stat = os.stat(self.source)
+        os.utime(self.source, ns=(stat.st_atime_ns,
+                                  stat.st_mtime_ns + 10 ** 9))
+
+    def update(self, create=False):
+        return store.update_view(self.view, self.source, create)
+
+
+class ViewTests(StoreTestCase):
+
+    def test_not_created_by_default(self):
+        self.assertFalse(self.update())
+        self.assertFalse(os.path.exists(self.view))
+
+    def test_missing_source(self):
+        self.source = os.path.join(self.tmp.name, "missing")
+        self.assertFalse(self.update(create=True))
+        self.assertFalse(os.path.exists(self.view))
+
+    def test_create(self):
+        self.assertTrue(self.update(create=True))
+        self.assertEqual(sorted(os.listdir(self.view)), [
+            ".cache", "1920x1080", "loading_1.jpg", "loading_2.jpg",
+        ])
+        self.assertEqual(
+            os.readlink(os.path.join(self.view, "loading_1.jpg")),
+            os.path.join(self.source, "loading_1.jpg"),
+        )
+        self.assertTrue(self.update())
+
+    def test_create_next_to_caches(self):
+        # The Steam and session caches are kept in the default directory
+        self.write(self.view, ".cache/steam.json", "{}")
+        self.assertTrue(self.update(create=True))
+        self.assertTrue(
+            os.path.islink(os.path.join(self.view, "loading_1.jpg"))
+        )
+
+    def test_user_wallpapers_not_replaced(self):
+        for name in [manifest.MANIFEST_FILE, "loading_1.png"]:
+            with self.subTest(name=name):
+                path = self.write(self.view, name)
+                self.assertFalse(self.update(create=True))
+                self.assertIsNone(store.load_view(self.view))
+                os.remove(path)
+
+    def test_resync(self):
+        self.update(create=True)
+        self.write(self.view, "mine.jpg")
+
+        os.remove(os.path.join(self.source, "loading_2.jpg"))
+        self.write(self.source, "loading_3.jpg")
+        self.touch_source()
+
+        self.assertTrue(self.update())
+        self.assertEqual(sorted(os.listdir(self.view)), [
+            ".cache", "1920x1080", "loading_1.jpg", "loading_3.jpg",
+            "mine.jpg",
+        ])
+
+    def test_resync_updates_slideshow(self):
+        self.update(create=True)
+        slideshow.update(self.view)
+
+        self.write(self.source, "loading_3.jpg")
+        self.touch_source()
+        self.update()
+
+        self.assertIn(
+            "loading_3.jpg", slideshow.load_state(self.view)["order"]
+        )
+
+    def test_remove(self):
+        self.update(create=True)
+        self.write(self.view, "mine.jpg")
+
+        store.remove_view(self.view)
+        self.assertEqual(sorted(os.listdir(self.view)), [".cache", "mine.jpg"])
+        self.assertIsNone(store.load_view(self.view))
+        self.assertTrue(os.path.exists(os.path.join(self.source,
+                                                    "loading_1.jpg")))
+
+
+class ExtractIntoViewTests(StoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.game = synthetic.make_game_dir(
+            os.path.join(self.tmp.name, "game"),
+            {"uitextures.fpk": [("readme.txt", b"hello")]},
+        )
+        self.update(create=True)
+
+    def test_extract_replaces_view(self):
+        with mock.patch.object(extractor, "dds", None):
+            extractor.extract_wallpapers(
+                self.game, self.view, jobs=1, patterns=["*.txt"],
+            )
+
+        self.assertIsNone(store.load_view(self.view))
+        self.assertEqual(
+            sorted(name for name in os.listdir(self.view)
+                   if not name.startswith(".")),
+            ["readme.txt"],
+        )
+
+    def extract_cli(self, game_dir):
+        args = cli.build_argparse().parse_args([
+            "extract", "--game-dir", game_dir, "--output", self.view,
+        ])
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                cli.cmd_extract(args)
+
+    def assert_view_kept(self):
+        self.assertIsNotNone(store.load_view(self.view))
+        self.assertTrue(
+            os.path.islink(os.path.join(self.view, "loading_1.jpg"))
+        )
+        self.assertFalse(
+            os.path.exists(os.path.join(self.view, manifest.MANIFEST_FILE))
+        )
+
+    def test_failed_extract_keeps_view(self):
+        self.extract_cli(os.path.join(self.tmp.name, "missing"))
+        self.assert_view_kept()
+
+    def test_extract_without_packs_keeps_view(self):
+        empty = os.path.join(self.tmp.name, "empty")
+        os.makedirs(empty)
+        self.assertFalse(extractor.extract_wallpapers(empty, self.view))
+        self.assert_view_kept()
+
+        self.extract_cli(empty)
+        self.assert_view_kept()
@@ -0,0 +1,62 @@
+# Copyright (C) 2016 Pietro Albini <pietro@pietroalbini.org>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from unittest import mock
+import unittest
+import tempfile
+import os
+
+from civ5_wallpapers import extractor
+from civ5_wallpapers import verify
+
+from benchmarks import synthetic
+
+
+class VerifyOutputsTests(unittest.TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.game = synthetic.make_game_dir(
+            os.path.join(tmp.name, "game"), {"uitextures.fpk": [
+                ("a.txt", b"a"), ("b.txt", b"b"), ("c.txt", b"c"),
+            ]},
+        )
+        self.dest = os.path.join(tmp.name, "out")
+
+        # Without the decoder, the members are simply copied
+        with mock.patch.object(extractor, "dds", None):
+            extractor.extract_wallpapers(
+                self.game, self.dest, jobs=1, patterns=["*.txt"],
+            )
+
+    def verify(self):
+        return verify.verify(self.game, self.dest, jobs=2)
+
+    def test_valid(self):
+        self.assertEqual(self.verify(), [])
+
+    def test_broken_outputs(self):
+        os.remove(os.path.join(self.dest, "a.txt"))
+        with open(os.path.join(self.dest, "b.txt"), "w") as f:
+            f.write("corrupted")
+        os.remove(os.path.join(self.dest, "c.txt"))
+        os.mkdir(os.path.join(self.dest, "c.txt"))
+
+        self.assertEqual(self.verify(), [
+            "a.txt: a.txt is missing",
+            "b.txt: b.txt is corrupted",
+            "c.txt: c.txt can't be read: Is a directory",
+        ])